@@ -0,0 +1,141 @@
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from expenses import Expense
+from expense_index import connect
+
+
+MIN_BASELINE_COUNT = 5
+MAD_SCALE = 0.6745
+SCHEMA = """
+DROP TABLE IF EXISTS anomaly_meta;
+DROP TABLE IF EXISTS anomaly_scores;
+CREATE TABLE IF NOT EXISTS anomaly_rows (
+    row_key TEXT PRIMARY KEY,
+    claim_number TEXT NOT NULL,
+    member_id INTEGER,
+    peer_key TEXT,
+    value REAL NOT NULL,
+    member_z REAL NOT NULL,
+    peer_z REAL NOT NULL
+);
+"""
+FRAME_COLUMNS = ["member_id", "peer_key", "value"]
+
+
+def expenses_frame(expenses: List[Expense]) -> pd.DataFrame:
+    """One row per expense with the value compared against its baselines. Like
+    the thresholds, travel and overnight claims compare their price per unit
+    within their cost type and everything else its amount within its group."""
+    return pd.DataFrame(
+        {
+            "claim_number": [str(e.claim_number) for e in expenses],
+            "member_id": [e.member_id for e in expenses],
+            "peer_key": [e.expense_type if e.price_per_unit else e.group for e in expenses],
+            "value": [float(e.price_per_unit or e.amount_claimed) for e in expenses],
+        }
+    )
+
+
+def robust_z(df: pd.DataFrame, by: List[str]) -> pd.Series:
+    """Robust z-score of each value against the median/MAD of its group, or 0
+    where the group is too small or has no spread."""
+    keys = [df[c] for c in by]
+    median = df["value"].groupby(keys).transform("median")
+    deviation = (df["value"] - median).abs()
+    mad = deviation.groupby(keys).transform("median")
+    count = df["value"].groupby(keys).transform("count")
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = MAD_SCALE * (df["value"] - median) / mad
+    z = z.where((mad > 0) & (count >= MIN_BASELINE_COUNT), 0.0)
+    return z.replace([np.inf, -np.inf], 0.0).fillna(0.0)
+
+
+def anomaly_scores(expenses: List[Expense]) -> pd.DataFrame:
+    """Per claim deviation from the member's own history of the same kind of
+    claim and from all members' claims of that kind, indexed by claim number."""
+    return frame_anomaly_scores(expenses_frame(expenses))
+
+
+def frame_anomaly_scores(df: pd.DataFrame) -> pd.DataFrame:
+    """anomaly_scores from an already built expenses_frame."""
+    df = df[df["value"] > 0]
+    scores = pd.DataFrame(
+        {
+            "claim_number": df["claim_number"],
+            "member_z": robust_z(df, ["member_id", "peer_key"]),
+            "peer_z": robust_z(df, ["peer_key"]),
+        }
+    )
+    return scores.drop_duplicates("claim_number", keep="last").set_index("claim_number")
+
+
+def cached_anomaly_scores(expenses: List[Expense]) -> pd.DataFrame:
+    """anomaly_scores, reusing the stored scores where they can't have changed."""
+    return cached_frame_anomaly_scores(expenses_frame(expenses))
+
+
+def cached_frame_anomaly_scores(df: pd.DataFrame) -> pd.DataFrame:
+    """frame_anomaly_scores, keeping each row and its scores in the expenses
+    database. Rows are diffed against the stored ones and only the member and
+    peer groups holding an added, changed or removed row are scored again."""
+    df = df[df["value"] > 0].copy()
+    # Like keyed_expenses, repeated claim numbers get their occurrence appended
+    occurrence = df.groupby("claim_number").cumcount() + 1
+    df["row_key"] = df["claim_number"].where(
+        occurrence == 1, df["claim_number"] + "#" + occurrence.astype(str)
+    )
+    df = df.drop_duplicates("row_key", keep="last").set_index("row_key")
+
+    conn = connect()
+    conn.executescript(SCHEMA)
+    try:
+        stored = pd.read_sql("SELECT * FROM anomaly_rows", conn, index_col="row_key")
+        removed = stored.index.difference(df.index)
+        both = df.index.intersection(stored.index)
+        differs = both[(df.loc[both, FRAME_COLUMNS] != stored.loc[both, FRAME_COLUMNS]).any(axis=1).to_numpy()]
+        changed = df.index.difference(stored.index).append(differs)
+
+        if len(changed) == 0 and len(removed) == 0:
+            print("Using cached anomaly scores.")
+            scores = stored.loc[df.index, ["claim_number", "member_z", "peer_z"]]
+            return scores.drop_duplicates("claim_number", keep="last").set_index("claim_number")
+
+        # Groups whose baseline moved, before and after the change
+        touched = pd.concat([df.loc[changed, FRAME_COLUMNS], stored.loc[removed.append(differs), FRAME_COLUMNS]])
+        member_groups = pd.MultiIndex.from_frame(touched[["member_id", "peer_key"]])
+        in_member_group = pd.MultiIndex.from_frame(df[["member_id", "peer_key"]]).isin(member_groups)
+        in_peer_group = df["peer_key"].isin(touched["peer_key"]).to_numpy()
+
+        scores = stored.reindex(df.index)[["member_z", "peer_z"]]
+        scores.loc[in_member_group, "member_z"] = robust_z(df[in_member_group], ["member_id", "peer_key"])
+        scores.loc[in_peer_group, "peer_z"] = robust_z(df[in_peer_group], ["peer_key"])
+        rescored = df.index[in_member_group | in_peer_group]
+
+        rows = df.loc[rescored].join(scores.loc[rescored])
+        with conn:
+            conn.executemany("DELETE FROM anomaly_rows WHERE row_key = ?", ((k,) for k in removed))
+            conn.executemany(
+                "INSERT OR REPLACE INTO anomaly_rows VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows[["claim_number", *FRAME_COLUMNS, "member_z", "peer_z"]].itertuples(index=True, name=None),
+            )
+        print(
+            f"Computed anomaly scores for {len(rescored)} of {len(df)} claims, "
+            f"{len(changed)} changed and {len(removed)} removed."
+        )
+        scores.insert(0, "claim_number", df["claim_number"])
+        return scores.drop_duplicates("claim_number", keep="last").set_index("claim_number")
+    finally:
+        conn.close()
+
+
+def anomaly_weights(expenses: List[Expense], scores: Optional[pd.DataFrame]) -> np.ndarray:
+    """The largest positive robust z-score for each expense, 0 if unscored."""
+    if scores is None or len(expenses) == 0:
+        return np.zeros(len(expenses))
+    claims = [str(e.claim_number) for e in expenses]
+    z = scores.reindex(claims)[["member_z", "peer_z"]].fillna(0.0).to_numpy()
+    return np.clip(z.max(axis=1), 0.0, None)
@@ -1,19 +1,25 @@
 import json
-from typing import Dict, Any, Union
+from typing import Dict, Any, Union, Set, Optional
 
 import boto3
+from botocore.exceptions import ClientError
 
 from tools import *
+import local_services
+from local_services import local_services_enabled
 
 TABLE_NAME = os.getenv("MPE_DDB_TABLE_NAME")
+STORAGE_BUCKET = os.getenv("MPE_QUEUE_BUCKET")
 S3_CLIENT = boto3.client("s3")
-SECRETS_MANAGER = boto3.client("secretsmanager")
-DYNAMODB = boto3.resource("dynamodb")
-DDB_TABLE = DYNAMODB.Table(TABLE_NAME)
 
-
-def in_aws() -> bool:
-    return os.environ.get("AWS_EXECUTION_ENV") is not None
+# Local stand-ins let the handler run without AWS
+if local_services_enabled():
+    SECRETS_MANAGER = local_services.SECRETS_MANAGER
+    DDB_TABLE = local_services.DDB_TABLE
+else:
+    SECRETS_MANAGER = boto3.client("secretsmanager")
+    DYNAMODB = boto3.resource("dynamodb")
+    DDB_TABLE = DYNAMODB.Table(TABLE_NAME)
 
 
 def get_secret_dict(name: str) -> Dict[str, Any]:
@@ -37,3 +43,70 @@ def item_in_db(item_id: Union[str, int]) -> bool:
         return "Item" in response
     except Exception as e:
         print("Error checking item:", e)
+
+
+def claim_item_in_db(item: dict) -> bool:
+    """Put the item only if its expense_id isn't already in the table,
+    returning whether this call was the one to claim it."""
+    try:
+        DDB_TABLE.put_item(Item=item, ConditionExpression="attribute_not_exists(expense_id)")
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return False
+        raise e
+
+
+def delete_item_from_db(item_id: Union[str, int]) -> None:
+    DDB_TABLE.delete_item(Key={"expense_id": str(item_id)})
+
+
+def get_all_item_ids() -> Set[str]:
+    item_ids = set()
+    kwargs = {"ProjectionExpression": "expense_id"}
+    while True:
+        response = DDB_TABLE.scan(**kwargs)
+        item_ids.update(item["expense_id"] for item in response["Items"])
+        if "LastEvaluatedKey" not in response:
+            break
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    print(f"Found {len(item_ids)} items in db.")
+    return item_ids
+
+
+def get_s3_json(bucket: str, key: str) -> Optional[Any]:
+    try:
+        response = S3_CLIENT.get_object(Bucket=bucket, Key=key)
+    except S3_CLIENT.exceptions.NoSuchKey:
+        return None
+    return json.loads(response["Body"].read())
+
+
+def save_s3_json(d: Any, bucket: str, key: str) -> None:
+    S3_CLIENT.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps(d, default=str, ensure_ascii=False).encode("utf-8"),
+        ContentType="application/json",
+    )
+
+
+def load_stored_json(key: str) -> Optional[Any]:
+    """Load a JSON document from the storage bucket, or the local cache dir
+    when no bucket is configured."""
+    if STORAGE_BUCKET:
+        return get_s3_json(STORAGE_BUCKET, key)
+    try:
+        return load_json(os.path.join(cache_dir(), key))
+    except FileNotFoundError:
+        return None
+
+
+def save_stored_json(d: Any, key: str) -> None:
+    if STORAGE_BUCKET:
+        save_s3_json(d, STORAGE_BUCKET, key)
+        return
+    path = os.path.join(cache_dir(), key)
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    save_json(d, path + ".tmp", indent=None)
+    os.replace(path + ".tmp", path)
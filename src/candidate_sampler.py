@@ -0,0 +1,152 @@
+import random
+from datetime import date
+from typing import List, Dict, Any, Optional, Set
+
+import numpy as np
+import pandas as pd
+
+from expenses import Expense
+from anomaly_scores import anomaly_weights
+from expense_filter import Thresholds
+from members import is_member_of_note
+
+
+VIP_WEIGHT = 3.0
+MAX_THRESHOLD_RATIO = 10.0
+RECENCY_HALF_LIFE_DAYS = 90
+REBUILD_USED_FRACTION = 0.5
+MIN_WEIGHT = 1e-6
+MAX_ANOMALY_Z = 10.0
+
+
+def score_expenses(
+    expenses: List[Expense],
+    thresholds: Thresholds,
+    today: date,
+    anomalies: Optional[pd.DataFrame] = None,
+) -> np.ndarray:
+    """Interest weight per expense from how far it is over its threshold, how
+    unusual it is for the member and their peers, whether the member is of
+    note and how recent the claim is."""
+    travel_thresholds, group_thresholds = thresholds
+    n = len(expenses)
+    if n == 0:
+        return np.zeros(0)
+
+    amounts = np.fromiter((float(e.amount_claimed) for e in expenses), float, n)
+    per_unit = np.fromiter(
+        (float(e.price_per_unit) if e.price_per_unit else np.nan for e in expenses), float, n
+    )
+    travel_limits = np.fromiter(
+        (travel_thresholds.get(e.expense_type, np.nan) for e in expenses), float, n
+    )
+    group_limits = np.fromiter(
+        (group_thresholds.get(e.group, np.nan) for e in expenses), float, n
+    )
+    vip = np.fromiter((is_member_of_note(e.member_id) for e in expenses), bool, n)
+    age_days = np.fromiter(((today - e.date).days for e in expenses), float, n)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(np.isnan(per_unit), amounts / group_limits, per_unit / travel_limits)
+    ratio = np.clip(np.nan_to_num(ratio, nan=1.0, posinf=1.0), 1.0, MAX_THRESHOLD_RATIO)
+
+    anomaly_factor = 1.0 + np.minimum(anomaly_weights(expenses, anomalies), MAX_ANOMALY_Z)
+    vip_factor = np.where(vip, VIP_WEIGHT, 1.0)
+    recency = np.exp2(-np.clip(age_days, 0, None) / RECENCY_HALF_LIFE_DAYS)
+    return np.maximum(ratio * anomaly_factor * vip_factor * recency, MIN_WEIGHT)
+
+
+class AliasTable:
+    """Walker/Vose alias table giving O(1) draws from a fixed discrete distribution."""
+
+    def __init__(self, prob: List[float], alias: List[int]):
+        self.prob = prob
+        self.alias = alias
+
+    def __len__(self):
+        return len(self.prob)
+
+    @classmethod
+    def build(cls, weights: np.ndarray) -> "AliasTable":
+        n = len(weights)
+        total = float(np.sum(weights))
+        if n == 0 or total <= 0:
+            return cls([1.0] * n, list(range(n)))
+
+        scaled = (np.asarray(weights, dtype=float) * n / total).tolist()
+        prob = [1.0] * n
+        alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        return cls(prob, alias)
+
+    def draw(self) -> int:
+        i = random.randrange(len(self.prob))
+        return i if random.random() < self.prob[i] else self.alias[i]
+
+
+class CandidateSampler:
+    """Weighted sampling over a candidate list where used entries are rejected
+    on draw instead of rebuilding the table, which is only rebuilt once the
+    used entries make up REBUILD_USED_FRACTION of it."""
+
+    def __init__(
+        self,
+        entries: List[Any],
+        weights: List[float],
+        table: Optional[AliasTable] = None,
+        used: Optional[Set[int]] = None,
+    ):
+        self.entries = entries
+        self.weights = list(weights)
+        self.table = table or AliasTable.build(np.asarray(self.weights, dtype=float))
+        self.used = used or set()
+
+    def __len__(self):
+        return len(self.entries) - len(self.used)
+
+    def rebuild(self) -> None:
+        keep = [i for i in range(len(self.entries)) if i not in self.used]
+        self.entries = [self.entries[i] for i in keep]
+        self.weights = [self.weights[i] for i in keep]
+        self.table = AliasTable.build(np.asarray(self.weights, dtype=float))
+        self.used = set()
+
+    def draw(self, skip: Optional[Set[int]] = None) -> Optional[int]:
+        """Index of a weighted random unused entry, not in skip."""
+        skip = skip or set()
+        if len(self) - len(skip - self.used) <= 0:
+            return None
+        while True:
+            i = self.table.draw()
+            if i not in self.used and i not in skip:
+                return i
+
+    def mark_used(self, *indexes: int) -> None:
+        self.used.update(indexes)
+        if len(self.used) > REBUILD_USED_FRACTION * len(self.entries):
+            self.rebuild()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "entries": self.entries,
+            "weights": self.weights,
+            "prob": self.table.prob,
+            "alias": self.table.alias,
+            "used": sorted(self.used),
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "CandidateSampler":
+        if "prob" not in d:
+            return cls(d["entries"], [1.0] * len(d["entries"]))
+        return cls(
+            d["entries"], d["weights"], AliasTable(d["prob"], d["alias"]), set(d["used"])
+        )
@@ -0,0 +1,134 @@
+import os
+import gzip
+import json
+import mmap
+import zlib
+import hashlib
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# What a damaged body can raise while being decompressed
+DECOMPRESS_ERRORS = (OSError, EOFError, ValueError, zlib.error) + (
+    (zstandard.ZstdError,) if zstandard is not None else ()
+)
+
+
+MAGIC = b"MPECACHE1\n"
+CODEC = os.getenv("MPE_CACHE_CODEC", "zstd" if zstandard is not None else "gzip")
+
+
+class CacheCorruptError(Exception):
+    pass
+
+
+def compress(body: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(body)
+    if codec == "gzip":
+        return gzip.compress(body, compresslevel=6)
+    if codec == "none":
+        return body
+    raise ValueError(f"Unknown cache codec '{codec}'")
+
+
+def decompress(body: memoryview, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise CacheCorruptError("Cache file is zstd compressed but zstandard isn't installed")
+        return zstandard.ZstdDecompressor().decompress(body)
+    if codec == "gzip":
+        return gzip.decompress(body)
+    if codec == "none":
+        return bytes(body)
+    raise CacheCorruptError(f"Unknown cache codec '{codec}'")
+
+
+def write_cache_file(path: str, text: str, validators: Optional[Dict[str, str]] = None) -> None:
+    """Write text as a header line followed by the compressed body. The file is
+    written alongside and renamed into place so readers never see a partial file."""
+    body = text.encode("utf-8")
+    compressed = compress(body, CODEC)
+    header = {
+        "codec": CODEC,
+        "sha256": hashlib.sha256(body).hexdigest(),
+        "length": len(body),
+        "compressed_length": len(compressed),
+        "saved": datetime.utcnow().isoformat(),
+        **(validators or {}),
+    }
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        f.write(MAGIC)
+        f.write(json.dumps(header).encode("utf-8") + b"\n")
+        f.write(compressed)
+    os.replace(path + ".tmp", path)
+    print(f"Saved cache file {path} ({len(compressed)} of {len(body)} bytes, {CODEC}).")
+
+
+def read_cache_header(mm: mmap.mmap) -> Tuple[Dict[str, Any], int]:
+    if mm[:len(MAGIC)] != MAGIC:
+        raise CacheCorruptError("Missing cache file header")
+    header_end = mm.find(b"\n", len(MAGIC))
+    if header_end < 0:
+        raise CacheCorruptError("Truncated cache file header")
+    try:
+        header = json.loads(mm[len(MAGIC):header_end])
+    except ValueError as e:
+        raise CacheCorruptError(f"Unreadable cache file header - {e}")
+    if not isinstance(header, dict):
+        raise CacheCorruptError(f"Cache file header is not an object - {header!r:.50}")
+    return header, header_end + 1
+
+
+def read_cache_file(path: str) -> Tuple[str, Dict[str, Any]]:
+    """The cached text and its header, read through mmap. Raises
+    FileNotFoundError if missing and CacheCorruptError if it fails its checks."""
+    try:
+        return read_checked_cache_file(path)
+    except (KeyError, TypeError) as e:
+        raise CacheCorruptError(f"Incomplete cache file header - {e!r}")
+
+
+def read_checked_cache_file(path: str) -> Tuple[str, Dict[str, Any]]:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise CacheCorruptError("Empty cache file")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            header, offset = read_cache_header(mm)
+            if len(mm) - offset != header["compressed_length"]:
+                raise CacheCorruptError(
+                    f"Cache body is {len(mm) - offset} bytes, expected {header['compressed_length']}"
+                )
+            view = memoryview(mm)[offset:]
+            try:
+                body = decompress(view, header["codec"])
+            except DECOMPRESS_ERRORS as e:
+                raise CacheCorruptError(f"Cache body failed to decompress - {e}")
+            finally:
+                view.release()
+
+    if len(body) != header["length"] or hashlib.sha256(body).hexdigest() != header["sha256"]:
+        raise CacheCorruptError("Cache body checksum mismatch")
+    return body.decode("utf-8"), header
+
+
+def read_cache_info(path: str) -> Dict[str, Any]:
+    """Just the header, without reading the body. Empty if missing or unreadable."""
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            header, _ = read_cache_header(mm)
+    except (FileNotFoundError, ValueError, CacheCorruptError):
+        return {}
+    return header
+
+
+def read_cache_validators(path: str) -> Dict[str, str]:
+    """Just the HTTP validators stored in the header, without reading the body."""
+    header = read_cache_info(path)
+    return {k: header[k] for k in ("etag", "last_modified") if header.get(k)}
@@ -0,0 +1,100 @@
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Optional
+
+from expenses import Expense, keyed_expenses
+from expense_importer import get_expenses
+from tools import load_json, save_json, cache_dir
+
+
+class ExpenseDelta:
+
+    def __init__(
+        self,
+        year_code: str,
+        added: List[Expense],
+        changed: List[Expense],
+        removed: List[str],
+    ):
+        self.year_code = year_code
+        self.added = added
+        self.changed = changed
+        self.removed = removed
+
+    def __repr__(self):
+        return (
+            f"<ExpenseDelta {self.year_code}: added={len(self.added)} "
+            f"changed={len(self.changed)} removed={len(self.removed)}>"
+        )
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.changed or self.removed)
+
+    @property
+    def updated(self) -> List[Expense]:
+        return self.added + self.changed
+
+
+def manifest_path(year_code: str) -> str:
+    return os.path.join(cache_dir(), f"{year_code}.manifest.json")
+
+
+def load_manifest(year_code: str) -> Optional[Dict[str, str]]:
+    try:
+        return load_json(manifest_path(year_code))["rows"]
+    except FileNotFoundError:
+        return None
+
+
+def save_manifest(year_code: str, rows: Dict[str, str]) -> None:
+    path = manifest_path(year_code)
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    save_json(
+        {
+            "year_code": year_code,
+            "created": datetime.utcnow().isoformat(),
+            "row_count": len(rows),
+            "rows": rows,
+        },
+        path,
+        indent=None,
+    )
+
+
+def diff_expenses(year_code: str, expenses: List[Expense], save: bool = True) -> ExpenseDelta:
+    """Compare expenses against the last manifest for the year, returning the
+    rows added, changed and removed since then."""
+    previous = load_manifest(year_code) or {}
+    current = keyed_expenses(expenses)
+
+    added = []
+    changed = []
+    for key, expense in current.items():
+        old_hash = previous.get(key)
+        if old_hash is None:
+            added.append(expense)
+        elif old_hash != expense.content_hash:
+            changed.append(expense)
+    removed = [key for key in previous if key not in current]
+
+    delta = ExpenseDelta(year_code, added, changed, removed)
+    print(f"Found {delta} against previous manifest of {len(previous)} rows.")
+
+    if save and not delta.is_empty:
+        save_manifest(year_code, {key: e.content_hash for key, e in current.items()})
+    return delta
+
+
+def get_expenses_delta(year_code: str, force: bool = True) -> ExpenseDelta:
+    return diff_expenses(year_code, get_expenses(year_code, force))
+
+
+def get_new_expenses(year_codes: List[str], include_changed: bool = False) -> List[Expense]:
+    """Newly published claims across the years given since they were last seen."""
+    expenses = []
+    for year_code in year_codes:
+        delta = get_expenses_delta(year_code)
+        expenses += delta.updated if include_changed else delta.added
+    return expenses
@@ -1,71 +1,243 @@
 from datetime import date
-from typing import List, Dict
+from typing import List, Dict, Tuple, Optional, Callable, Set, Any
 
 from expenses import (
     Expense,
     generate_group_thresholds,
     generate_travel_thresholds,
+    group_threshold_values,
+    travel_threshold_values,
+    merge_threshold_values,
+    thresholds_from_values,
 )
-from members import is_member_of_note
-from tools import pp
+from members import is_member_of_note, VIP_MEMBERS_FILE
+from tools import pp, load_json
 
 
-def expenses_filter(expenses: List[Expense]) -> List[Expense]:
-    travel_thresholds = generate_travel_thresholds(expenses, 5, 20)
-    group_thresholds = generate_group_thresholds(expenses, 5, 20)
+TOP_PERCENTILE = 5
+MINIMUM_COUNT = 20
+FILTER_PROFILES_FILE = "filter_profiles.json"
+
+Thresholds = Tuple[Dict[str, float], Dict[str, float]]
+
+
+def expense_thresholds(
+    expenses: List[Expense],
+    top_percentile: int = TOP_PERCENTILE,
+    minimum_count: int = MINIMUM_COUNT,
+) -> Thresholds:
+    travel_thresholds = generate_travel_thresholds(expenses, top_percentile, minimum_count)
+    group_thresholds = generate_group_thresholds(expenses, top_percentile, minimum_count)
+    return travel_thresholds, group_thresholds
+
+
+def streamed_expense_thresholds(
+    year_codes: List[str],
+    get_year_expenses: Callable[[str], List[Expense]],
+    top_percentile: int = TOP_PERCENTILE,
+    minimum_count: int = MINIMUM_COUNT,
+) -> Thresholds:
+    """expense_thresholds over several years, loading one year at a time and
+    keeping only the values the percentiles need."""
+    travel_values = {}
+    group_values = {}
+    for year_code in year_codes:
+        expenses = get_year_expenses(year_code)
+        merge_threshold_values(travel_values, travel_threshold_values(expenses))
+        merge_threshold_values(group_values, group_threshold_values(expenses))
+        del expenses
+    return (
+        thresholds_from_values(travel_values, top_percentile, minimum_count),
+        thresholds_from_values(group_values, top_percentile, minimum_count),
+    )
+
+
+def expenses_filter(
+    expenses: List[Expense], thresholds: Optional[Thresholds] = None
+) -> List[Expense]:
+    travel_thresholds, group_thresholds = thresholds or expense_thresholds(expenses)
     return [
         e for e in expenses if expense_filter(e, travel_thresholds, group_thresholds)
     ]
 
 
 def expense_filter(
-    expense: Expense, travel_thresholds: Dict[str, float], group_thresholds: Dict[str, float]
+    expense: Expense,
+    travel_thresholds: Dict[str, float],
+    group_thresholds: Dict[str, float],
+    is_vip: Callable[[int], bool] = is_member_of_note,
 ) -> bool:
     try:
-        # Not in the future
-        if expense.date > date.today():
+        if expense_excluded(expense):
             return False
+        return expense_of_interest(expense, travel_thresholds, group_thresholds, is_vip)
 
-        # Removes weird data
-        if str(expense.claim_number) == "1" or expense.amount_claimed <= 0:
-            return False
+    except Exception as e:
+        print(f"ERROR '{e}' when filtering expense {expense}.")
+        pp(expense._data)
+
+    return False
+
+
+def expense_excluded(expense: Expense) -> bool:
+    # Not in the future
+    if expense.date > date.today():
+        return True
+
+    # Removes weird data
+    if str(expense.claim_number) == "1" or expense.amount_claimed <= 0:
+        return True
+
+    # Ignore rail booking fees
+    if expense.is_rail_booking_fee and expense.amount_claimed <= 5:
+        return True
+
+    return False
+
+
+def expense_of_interest(
+    expense: Expense,
+    travel_thresholds: Dict[str, float],
+    group_thresholds: Dict[str, float],
+    is_vip: Callable[[int], bool] = is_member_of_note,
+) -> bool:
+    # First class (data not given anymore)
+    if expense.is_first_class:
+        return True
+
+    # If a popular MP, use their expense regardless
+    if is_vip(expense.member_id):
+        return True
+
+    # Always use certain expense types
+    if any(
+        (
+            expense.is_air_travel(),
+            expense.is_taxi_ride(),
+            #expense.is_energy(),
+        )
+    ):
+        return True
+
+    # Always use very small claims
+    if expense.amount_claimed < 3:
+        return True
+
+    # If overnight stay or transport, check if price per unit is above threshold
+    if expense.price_per_unit:
+        return expense.price_per_unit > travel_thresholds.get(expense.expense_type, 99999)
 
-        # Ignore rail booking fees
-        if expense.is_rail_booking_fee and expense.amount_claimed <= 5:
+    # Check expense 'group' and if amount is above group threshold value
+    if expense.amount_claimed >= group_thresholds.get(expense.group, 99999):
+        return True
+
+    return False
+
+
+_VIP_MEMBER_IDS: Dict[str, Set[int]] = {}
+
+
+def vip_member_ids(file_path: str) -> Set[int]:
+    if file_path not in _VIP_MEMBER_IDS:
+        _VIP_MEMBER_IDS[file_path] = set(load_json(file_path).values())
+    return _VIP_MEMBER_IDS[file_path]
+
+
+class FilterProfile:
+    """Rules for one feed: the threshold parameters plus which expenses and
+    members the feed is restricted to."""
+
+    def __init__(
+        self,
+        name: str,
+        top_percentile: int = TOP_PERCENTILE,
+        minimum_count: int = MINIMUM_COUNT,
+        vip_members_file: str = VIP_MEMBERS_FILE,
+        vip_only: bool = False,
+        expense_types: Optional[List[str]] = None,
+        parties: Optional[List[str]] = None,
+        constituencies: Optional[List[str]] = None,
+    ):
+        self.name = name
+        self.top_percentile = top_percentile
+        self.minimum_count = minimum_count
+        self.vip_members_file = vip_members_file
+        self.vip_only = vip_only
+        self.expense_types = {t.upper() for t in expense_types} if expense_types else None
+        self.parties = {p.upper() for p in parties} if parties else None
+        self.constituencies = {c.upper() for c in constituencies} if constituencies else None
+
+    def __repr__(self):
+        return f"<FilterProfile {self.name}>"
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "FilterProfile":
+        return cls(**d)
+
+    @property
+    def threshold_key(self) -> Tuple[int, int]:
+        return self.top_percentile, self.minimum_count
+
+    def is_vip(self, member_id: int) -> bool:
+        # Compared the same way as is_member_of_note
+        return str(member_id) in vip_member_ids(self.vip_members_file)
+
+    def in_scope(self, expense: Expense) -> bool:
+        """Cheap checks on the expense row itself."""
+        if self.vip_only and not self.is_vip(expense.member_id):
+            return False
+        if self.expense_types is not None and expense.expense_type not in self.expense_types:
             return False
+        if self.constituencies is not None and str(expense.constituency).upper() not in self.constituencies:
+            return False
+        return True
 
-        # First class (data not given anymore)
-        if expense.is_first_class:
+    def member_in_scope(self, expense: Expense) -> bool:
+        """Checks needing a member lookup, so only done on otherwise selected expenses."""
+        if self.parties is None:
             return True
+        member = expense.member
+        return member is not None and member.party_abbr.upper() in self.parties
 
-        # If a popular MP, use their expense regardless
-        if is_member_of_note(expense.member_id):
-            return True
 
-        # Always use certain expense types
-        if any(
-            (
-                expense.is_air_travel(),
-                expense.is_taxi_ride(),
-                #expense.is_energy(),
-            )
-        ):
-            return True
+DEFAULT_PROFILE = FilterProfile("default")
 
-        # Always use very small claims
-        if expense.amount_claimed < 3:
-            return True
 
-        # If overnight stay or transport, check if price per unit is above threshold
-        if expense.price_per_unit:
-            return expense.price_per_unit > travel_thresholds.get(expense.expense_type, 99999)
+def load_filter_profiles(file_path: str = FILTER_PROFILES_FILE) -> List[FilterProfile]:
+    return [FilterProfile.from_dict(d) for d in load_json(file_path)]
 
-        # Check expense 'group' and if amount is above group threshold value
-        if expense.amount_claimed >= group_thresholds.get(expense.group, 99999):
-            return True
 
-    except Exception as e:
-        print(f"ERROR '{e}' when filtering expense {expense}.")
-        pp(expense._data)
+def multi_profile_filter(
+    expenses: List[Expense], profiles: List[FilterProfile]
+) -> Dict[str, List[Expense]]:
+    """Filter expenses for several profiles in one pass over the data. Thresholds
+    are computed once per distinct set of threshold parameters and the checks
+    common to every profile are done once per expense."""
+    thresholds = {
+        key: expense_thresholds(expenses, *key) for key in {p.threshold_key for p in profiles}
+    }
+    results = {p.name: [] for p in profiles}
 
-    return False
+    for expense in expenses:
+        try:
+            if expense_excluded(expense):
+                continue
+        except Exception as e:
+            print(f"ERROR '{e}' when filtering expense {expense}.")
+            pp(expense._data)
+            continue
+
+        for profile in profiles:
+            try:
+                if (
+                    profile.in_scope(expense)
+                    and expense_of_interest(expense, *thresholds[profile.threshold_key], profile.is_vip)
+                    and profile.member_in_scope(expense)
+                ):
+                    results[profile.name].append(expense)
+            except Exception as e:
+                print(f"ERROR '{e}' when filtering expense {expense} for {profile}.")
+
+    for name, selected in results.items():
+        print(f"Profile '{name}' selected {len(selected)} of {len(expenses)} expenses.")
+    return results
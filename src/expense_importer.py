@@ -1,20 +1,22 @@
 import os
 from datetime import datetime
 import requests
-from typing import List
+from typing import List, Dict, Optional
 import time
 from io import StringIO
 import pandas as pd
 from numpy import nan
-from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor
 
-from aws_tools import in_aws
 from expenses import Expense
-from tools import pp, load_text, save_text, get_year_codes_range
+from expense_index import index_expenses
+from expense_store import refresh_rollups
+from keyword_index import index_keywords
+from csv_cache import write_cache_file, read_cache_file, read_cache_validators, CacheCorruptError
+from tools import pp, get_year_codes_range, cache_dir, in_aws
 
 
-CACHE_DIR = "../csv_cache"
+IPSA_URL = os.getenv("MPE_IPSA_URL", "https://www.theipsa.org.uk")
 EXPECTED_FIELDS = [
     "Parliamentary ID",
     "Year",
@@ -52,34 +54,70 @@ def get_expenses_csv(year_code: str, force: bool = False) -> str:
         if csv_text is not None:
             return csv_text
 
+    # Revalidate the cached copy if there is one
+    validators = read_cache_validators(cached_csv_path(year_code))
+    headers = {}
+    if "etag" in validators:
+        headers["If-None-Match"] = validators["etag"]
+    if "last_modified" in validators:
+        headers["If-Modified-Since"] = validators["last_modified"]
+
     # Go download file
-    url = f"https://www.theipsa.org.uk/api/download?type=individualBusinessCosts&year={year_code}"
+    url = f"{IPSA_URL}/api/download?type=individualBusinessCosts&year={year_code}"
     resp = None
     while resp is None:
         try:
             print(f"Attempting to get {year_code} claim data from {url}")
             start = datetime.utcnow()
-            resp = requests.get(url)
+            resp = requests.get(url, headers=headers)
             seconds = (datetime.utcnow() - start).total_seconds()
         except Exception as e:
             print(f"Exception {e} trying to get {year_code} data, retrying...")
             time.sleep(2)
             continue
 
+    if resp.status_code == 304:
+        csv_text = get_cache_csv(year_code)
+        if csv_text is not None:
+            print(f"{year_code} csv not modified since cached, using cache.")
+            return csv_text
+        return get_expenses_csv_unconditional(year_code)
+
     resp.encoding = "utf-8"
     csv_text = resp.text
     print(f"Downloaded {year_code} csv of length {len(csv_text)} in {seconds} seconds.")
 
     # Save to cache
     if not in_aws():
-        save_cache_csv(csv_text, year_code)
+        save_cache_csv(csv_text, year_code, response_validators(resp))
 
     return csv_text
 
 
+def get_expenses_csv_unconditional(year_code: str) -> str:
+    """Download again without validators, for when the cache vanished after a 304."""
+    path = cached_csv_path(year_code)
+    if os.path.exists(path):
+        os.remove(path)
+    return get_expenses_csv(year_code, force=True)
+
+
+def response_validators(resp: requests.Response) -> Dict[str, str]:
+    validators = {}
+    if resp.headers.get("ETag"):
+        validators["etag"] = resp.headers["ETag"]
+    if resp.headers.get("Last-Modified"):
+        validators["last_modified"] = resp.headers["Last-Modified"]
+    return validators
+
+
 def get_expenses(year_code: str, force: bool = False) -> List[Expense]:
+    return parse_expenses(year_code, get_expenses_csv(year_code, force))
+
+
+def parse_expenses(year_code: str, csv_text: str) -> List[Expense]:
     exp_dicts = (
-        pd.read_csv(StringIO(get_expenses_csv(year_code, force)), na_values=None)
+        pd.read_csv(StringIO(csv_text), na_values=None)
         .replace({nan: None})
         .to_dict("records")
     )
@@ -114,6 +152,15 @@ def get_expenses(year_code: str, force: bool = False) -> List[Expense]:
         f"Found {len(expenses)} expenses for year code '{year_code}' "
         f"from {min_date} to {max_date}."
     )
+
+    # Keep the lookup index in step with what was ingested. The rollups and
+    # keyword postings track which indexed content they were built from so
+    # they catch up on their own.
+    if not in_aws():
+        index_expenses(year_code, expenses)
+        refresh_rollups(year_code)
+        index_keywords(year_code, expenses)
+
     return expenses
 
 
@@ -135,22 +182,23 @@ def get_expenses_since_year(from_year: int) -> List[Expense]:
     return get_mulityear_expenses(year_codes, force=True)
 
 
-def save_cache_csv(csv_string: str, year_code: str) -> None:
-    cached_path = cached_csv_path(year_code)
-    Path(cached_path).parent.mkdir(parents=True, exist_ok=True)
-    save_text(csv_string, cached_path)
+def save_cache_csv(csv_string: str, year_code: str, validators: Optional[Dict[str, str]] = None) -> None:
+    write_cache_file(cached_csv_path(year_code), csv_string, validators)
 
 
 def cached_csv_path(year_code: str) -> str:
-    return os.path.join(Path(__file__).parent.absolute(), CACHE_DIR, f"{year_code}.csv")
+    return os.path.join(cache_dir(), f"{year_code}.csv.cache")
 
 
-def get_cache_csv(year_code: str) -> str:
+def get_cache_csv(year_code: str) -> Optional[str]:
     cached_path = cached_csv_path(year_code)
     try:
-        csv_text = load_text(cached_path)
+        csv_text, _ = read_cache_file(cached_path)
         print(f"Found cache file {cached_path} so using that.")
         return csv_text
     except FileNotFoundError:
         pass
+    except CacheCorruptError as e:
+        print(f"Cache file {cached_path} is corrupt ({e}), removing it.")
+        os.remove(cached_path)
     return None
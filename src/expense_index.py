@@ -0,0 +1,172 @@
+import os
+import json
+import sqlite3
+import hashlib
+from datetime import datetime, date
+from pathlib import Path
+from typing import List, Optional, Tuple, Set
+
+from expenses import Expense, keyed_expenses
+from tools import cache_dir
+
+
+INDEX_FILE = "expenses.db"
+QUERY_CHUNK_SIZE = 500
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS expenses (
+    row_key TEXT PRIMARY KEY,
+    claim_number TEXT NOT NULL,
+    year_code TEXT NOT NULL,
+    member_id INTEGER NOT NULL,
+    date TEXT,
+    category TEXT,
+    expense_type TEXT,
+    amount_claimed REAL,
+    amount_paid REAL,
+    content_hash TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_expenses_claim ON expenses (claim_number);
+CREATE INDEX IF NOT EXISTS idx_expenses_member ON expenses (member_id, date);
+CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses (date);
+CREATE INDEX IF NOT EXISTS idx_expenses_category ON expenses (category, expense_type, date);
+CREATE INDEX IF NOT EXISTS idx_expenses_year ON expenses (year_code);
+
+CREATE TABLE IF NOT EXISTS years (
+    year_code TEXT PRIMARY KEY,
+    row_count INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    indexed_at TEXT NOT NULL
+);
+"""
+
+DateRange = Tuple[Optional[date], Optional[date]]
+
+
+def index_path() -> str:
+    return os.path.join(cache_dir(), INDEX_FILE)
+
+
+def connect(path: Optional[str] = None) -> sqlite3.Connection:
+    path = path or index_path()
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def expenses_fingerprint(expenses: List[Expense]) -> str:
+    hashes = sorted(e.content_hash for e in expenses)
+    return hashlib.sha1("".join(hashes).encode("utf-8")).hexdigest()
+
+
+def year_fingerprint(conn: sqlite3.Connection, year_code: str) -> Optional[str]:
+    row = conn.execute(
+        "SELECT fingerprint FROM years WHERE year_code = ?", (year_code,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def index_expenses(year_code: str, expenses: List[Expense]) -> bool:
+    """Replace the indexed rows for a year, returning False without touching
+    the index if the year's content is unchanged since it was last indexed."""
+    fingerprint = expenses_fingerprint(expenses)
+    conn = connect()
+    try:
+        if year_fingerprint(conn, year_code) == fingerprint:
+            return False
+
+        rows = [
+            (
+                key,
+                str(e.claim_number),
+                year_code,
+                e.member_id,
+                e.date.isoformat(),
+                e.category,
+                e.expense_type,
+                float(e.amount_claimed),
+                float(e.amount_paid),
+                e.content_hash,
+                json.dumps(e._data, default=str, ensure_ascii=False),
+            )
+            for key, e in keyed_expenses(expenses).items()
+        ]
+        with conn:
+            conn.execute("DELETE FROM expenses WHERE year_code = ?", (year_code,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO expenses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO years VALUES (?, ?, ?, ?)",
+                (year_code, len(rows), fingerprint, datetime.utcnow().isoformat()),
+            )
+        print(f"Indexed {len(rows)} expenses for year code '{year_code}'.")
+        return True
+    finally:
+        conn.close()
+
+
+def date_range_clause(date_range: Optional[DateRange]) -> Tuple[str, list]:
+    if date_range is None:
+        return "", []
+    clause = ""
+    params = []
+    from_date, to_date = date_range
+    if from_date is not None:
+        clause += " AND date >= ?"
+        params.append(from_date.isoformat())
+    if to_date is not None:
+        clause += " AND date <= ?"
+        params.append(to_date.isoformat())
+    return clause, params
+
+
+def query_expenses(where: str, params: list) -> List[Expense]:
+    conn = connect()
+    try:
+        rows = conn.execute(f"SELECT data FROM expenses WHERE {where} ORDER BY date", params)
+        return [Expense(json.loads(data)) for (data,) in rows]
+    finally:
+        conn.close()
+
+
+def expenses_for_keys(row_keys: Set[str], date_range: Optional[DateRange] = None) -> List[Expense]:
+    clause, date_params = date_range_clause(date_range)
+    row_keys = sorted(row_keys)
+    expenses = []
+    for i in range(0, len(row_keys), QUERY_CHUNK_SIZE):
+        chunk = row_keys[i:i + QUERY_CHUNK_SIZE]
+        placeholders = ", ".join("?" * len(chunk))
+        expenses += query_expenses(f"row_key IN ({placeholders}){clause}", chunk + date_params)
+    return sorted(expenses, key=lambda e: e.date)
+
+
+def get_expense(claim_number: str) -> Optional[Expense]:
+    expenses = query_expenses("claim_number = ?", [str(claim_number)])
+    return expenses[0] if expenses else None
+
+
+def expenses_for_member(member_id: int, date_range: Optional[DateRange] = None) -> List[Expense]:
+    clause, params = date_range_clause(date_range)
+    return query_expenses(f"member_id = ?{clause}", [int(member_id)] + params)
+
+
+def expenses_for_category(
+    category: str, expense_type: Optional[str] = None, date_range: Optional[DateRange] = None
+) -> List[Expense]:
+    where = "category = ?"
+    params = [category]
+    if expense_type is not None:
+        where += " AND expense_type = ?"
+        params.append(expense_type.upper())
+    clause, date_params = date_range_clause(date_range)
+    return query_expenses(where + clause, params + date_params)
+
+
+def indexed_year_codes() -> List[str]:
+    conn = connect()
+    try:
+        return [row[0] for row in conn.execute("SELECT year_code FROM years ORDER BY year_code")]
+    finally:
+        conn.close()
@@ -0,0 +1,215 @@
+import sqlite3
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+
+from expense_index import connect, year_fingerprint, DateRange
+from members import get_member_or_none
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollups (
+    year_code TEXT NOT NULL,
+    member_id INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    expense_type TEXT NOT NULL,
+    month TEXT NOT NULL,
+    claim_count INTEGER NOT NULL,
+    total_claimed REAL NOT NULL,
+    total_paid REAL NOT NULL,
+    PRIMARY KEY (year_code, member_id, category, expense_type, month)
+);
+CREATE INDEX IF NOT EXISTS idx_rollups_month ON rollups (month);
+
+CREATE TABLE IF NOT EXISTS members (
+    member_id INTEGER PRIMARY KEY,
+    name TEXT,
+    party TEXT,
+    party_abbr TEXT,
+    retry_after TEXT
+);
+
+CREATE TABLE IF NOT EXISTS rollup_years (
+    year_code TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL
+);
+"""
+MEMBER_RETRY_HOURS = 24
+
+
+def store_connect() -> sqlite3.Connection:
+    conn = connect()
+    conn.executescript(SCHEMA)
+    # Stores created before failed lookups were recorded
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(members)")}
+    if "retry_after" not in columns:
+        conn.execute("ALTER TABLE members ADD COLUMN retry_after TEXT")
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def rollup_fingerprint(conn: sqlite3.Connection, year_code: str) -> Optional[str]:
+    row = conn.execute(
+        "SELECT fingerprint FROM rollup_years WHERE year_code = ?", (year_code,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def refresh_rollups(year_code: str) -> bool:
+    """Rebuild the materialised rollups for one year from the expense index,
+    returning False without rebuilding if they were built from the year's
+    currently indexed content."""
+    conn = store_connect()
+    try:
+        fingerprint = year_fingerprint(conn, year_code)
+        if fingerprint is not None and rollup_fingerprint(conn, year_code) == fingerprint:
+            return False
+
+        with conn:
+            conn.execute("DELETE FROM rollups WHERE year_code = ?", (year_code,))
+            conn.execute(
+                """
+                INSERT INTO rollups
+                SELECT year_code, member_id, COALESCE(category, ''), COALESCE(expense_type, ''),
+                       substr(date, 1, 7), COUNT(*), SUM(amount_claimed), SUM(amount_paid)
+                FROM expenses
+                WHERE year_code = ?
+                GROUP BY 1, 2, 3, 4, 5
+                """,
+                (year_code,),
+            )
+            if fingerprint is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO rollup_years VALUES (?, ?)", (year_code, fingerprint)
+                )
+        print(f"Refreshed expense rollups for year code '{year_code}'.")
+        return True
+    finally:
+        conn.close()
+
+
+def refresh_members(conn: sqlite3.Connection) -> None:
+    """Store name and party for any member in the rollups not seen before.
+    Failed lookups are recorded and only retried after MEMBER_RETRY_HOURS."""
+    now = datetime.utcnow()
+    member_ids = [
+        row[0]
+        for row in conn.execute(
+            "SELECT DISTINCT member_id FROM rollups WHERE member_id NOT IN "
+            "(SELECT member_id FROM members WHERE name IS NOT NULL OR retry_after > ?)",
+            (now.isoformat(),),
+        )
+    ]
+    if not member_ids:
+        return
+
+    with ThreadPoolExecutor() as executor:
+        members = list(executor.map(get_member_or_none, member_ids))
+
+    retry_after = (now + timedelta(hours=MEMBER_RETRY_HOURS)).isoformat()
+    rows = [
+        (member_id, m.name, m.party, m.party_abbr, None) if m else (member_id, None, None, None, retry_after)
+        for member_id, m in zip(member_ids, members)
+    ]
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO members (member_id, name, party, party_abbr, retry_after) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+    found = sum(1 for m in members if m is not None)
+    print(f"Stored details for {found} of {len(member_ids)} new members.")
+
+
+def month_range_clause(date_range: Optional[DateRange]) -> Tuple[str, list]:
+    clause = "1 = 1"
+    params = []
+    if date_range is None:
+        return clause, params
+    from_date, to_date = date_range
+    if from_date is not None:
+        clause += " AND r.month >= ?"
+        params.append(from_date.strftime("%Y-%m"))
+    if to_date is not None:
+        clause += " AND r.month <= ?"
+        params.append(to_date.strftime("%Y-%m"))
+    return clause, params
+
+
+def query_rollups(sql: str, params: list, resolve_members: bool = False) -> List[Dict[str, Any]]:
+    conn = store_connect()
+    try:
+        # Member details are looked up when first needed rather than at ingest
+        if resolve_members:
+            refresh_members(conn)
+        return [dict(row) for row in conn.execute(sql, params)]
+    finally:
+        conn.close()
+
+
+def top_claimants(limit: int = 10, date_range: Optional[DateRange] = None) -> List[Dict[str, Any]]:
+    where, params = month_range_clause(date_range)
+    return query_rollups(
+        f"""
+        SELECT r.member_id, m.name, m.party_abbr,
+               SUM(r.claim_count) AS claim_count, SUM(r.total_claimed) AS total_claimed
+        FROM rollups r LEFT JOIN members m ON m.member_id = r.member_id
+        WHERE {where}
+        GROUP BY r.member_id
+        ORDER BY total_claimed DESC
+        LIMIT ?
+        """,
+        params + [limit],
+        resolve_members=True,
+    )
+
+
+def party_totals(date_range: Optional[DateRange] = None) -> List[Dict[str, Any]]:
+    where, params = month_range_clause(date_range)
+    return query_rollups(
+        f"""
+        SELECT m.party_abbr, COUNT(DISTINCT r.member_id) AS member_count,
+               SUM(r.claim_count) AS claim_count, SUM(r.total_claimed) AS total_claimed
+        FROM rollups r LEFT JOIN members m ON m.member_id = r.member_id
+        WHERE {where}
+        GROUP BY m.party_abbr
+        ORDER BY total_claimed DESC
+        """,
+        params,
+        resolve_members=True,
+    )
+
+
+def category_totals(date_range: Optional[DateRange] = None) -> List[Dict[str, Any]]:
+    where, params = month_range_clause(date_range)
+    return query_rollups(
+        f"""
+        SELECT r.category, r.expense_type,
+               SUM(r.claim_count) AS claim_count, SUM(r.total_claimed) AS total_claimed
+        FROM rollups r
+        WHERE {where}
+        GROUP BY r.category, r.expense_type
+        ORDER BY total_claimed DESC
+        """,
+        params,
+    )
+
+
+def monthly_totals(
+    member_id: Optional[int] = None, date_range: Optional[DateRange] = None
+) -> List[Dict[str, Any]]:
+    where, params = month_range_clause(date_range)
+    if member_id is not None:
+        where += " AND r.member_id = ?"
+        params.append(int(member_id))
+    return query_rollups(
+        f"""
+        SELECT r.month, SUM(r.claim_count) AS claim_count,
+               SUM(r.total_claimed) AS total_claimed, SUM(r.total_paid) AS total_paid
+        FROM rollups r
+        WHERE {where}
+        GROUP BY r.month
+        ORDER BY r.month
+        """,
+        params,
+    )
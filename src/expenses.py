@@ -9,6 +9,8 @@ from io import StringIO
 from pathlib import Path
 import random
 import os
+import json
+import hashlib
 from numpy import percentile
 from logging import getLogger
 from functools import cached_property
@@ -40,6 +42,7 @@ class Expense:
         self.member_id = int(data["Parliamentary ID"])
         self.year_code = data["Year"]
         self.claim_number = data["Claim Number"]
+        self.constituency = data.get("Constituency")
         self.category = data["Category"]
         self.expense_type = data["Cost Type"].upper()
         self.amount_claimed = Decimal(str(data["Amount Claimed"]))
@@ -70,6 +73,11 @@ class Expense:
             f"{money_string(self.amount_claimed)} for {self.category} - {self.expense_type} - {self.short_desc}>"
         )
 
+    @cached_property
+    def content_hash(self) -> str:
+        row = json.dumps(self._data, sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha1(row.encode("utf-8")).hexdigest()
+
     @cached_property
     def group(self) -> str:
         return "/".join([
@@ -324,6 +332,20 @@ def exp_list_str(expenses: List[Expense]) -> str:
     return f"{len(expenses)} expenses from {date_range(expenses)}"
 
 
+def keyed_expenses(expenses: List[Expense]) -> Dict[str, Expense]:
+    """Key expenses by claim number, suffixing any repeated claim numbers
+    with their occurrence so duplicate rows still get a stable key."""
+    keyed = {}
+    for expense in expenses:
+        key = str(expense.claim_number)
+        occurrence = 1
+        while key in keyed:
+            occurrence += 1
+            key = f"{expense.claim_number}#{occurrence}"
+        keyed[key] = expense
+    return keyed
+
+
 def order_by_group(expenses: List[Expense]) -> dict:
     order = {}
     for expense in expenses:
@@ -338,18 +360,24 @@ def order_by_group(expenses: List[Expense]) -> dict:
 def generate_group_thresholds(
     expenses: List[Expense], top_percentile: int, minimum_count: int
 ) -> Dict[str, float]:
-    ordered = order_by_group(expenses)
-    thresholds = {}
-    for group, exp_list in ordered.items():
-        amounts = [float(e.amount_claimed) for e in exp_list if e.amount_claimed > 0]
-        if len(amounts) >= minimum_count:
-            thresholds[group] = round(percentile(amounts, 100 - top_percentile), 3)
-    return thresholds
+    return thresholds_from_values(group_threshold_values(expenses), top_percentile, minimum_count)
 
 
 def generate_travel_thresholds(
     expenses: List[Expense], top_percentile: int, minimum_count: int
 ) -> Dict[str, float]:
+    return thresholds_from_values(travel_threshold_values(expenses), top_percentile, minimum_count)
+
+
+def group_threshold_values(expenses: List[Expense]) -> Dict[str, List[float]]:
+    ordered = order_by_group(expenses)
+    return {
+        group: [float(e.amount_claimed) for e in exp_list if e.amount_claimed > 0]
+        for group, exp_list in ordered.items()
+    }
+
+
+def travel_threshold_values(expenses: List[Expense]) -> Dict[str, List[float]]:
     per_unit_values = {}
     for e in expenses:
 
@@ -362,16 +390,27 @@ def generate_travel_thresholds(
 
         exp_type = e.expense_type.upper()
         try:
-            per_unit_values[exp_type].append(unit)
+            per_unit_values[exp_type].append(float(unit))
         except KeyError:
-            per_unit_values[exp_type] = [unit]
+            per_unit_values[exp_type] = [float(unit)]
+    return per_unit_values
+
 
+def merge_threshold_values(
+    into: Dict[str, List[float]], values: Dict[str, List[float]]
+) -> Dict[str, List[float]]:
+    for key, value_list in values.items():
+        into.setdefault(key, []).extend(value_list)
+    return into
+
+
+def thresholds_from_values(
+    values: Dict[str, List[float]], top_percentile: int, minimum_count: int
+) -> Dict[str, float]:
     thresholds = {}
-    for exp_type, value_list in per_unit_values.items():
-        amounts = [float(x) for x in value_list]
+    for key, amounts in values.items():
         if len(amounts) >= minimum_count:
-            thresholds[exp_type] = round(percentile(amounts, 100 - top_percentile), 3)
-
+            thresholds[key] = round(percentile(amounts, 100 - top_percentile), 3)
     return thresholds
 
 
@@ -0,0 +1,150 @@
+"""Export the filtered claims for a range of years, with the text that would be
+tweeted for each, as CSV or JSON lines.
+
+    python export_cli.py --from-year 2015 --to-year 2025 --format csv --out claims.csv
+
+Years are processed one at a time so memory stays bounded however many years
+are exported. Member names are looked up in batches and kept in a cache file
+between runs. Progress messages go to stderr so stdout holds only the rows.
+"""
+import os
+import sys
+import csv
+import json
+import argparse
+from contextlib import redirect_stdout
+from typing import List, Dict, Any, Iterator, Optional, TextIO
+
+from expenses import Expense
+from expense_importer import get_expenses
+from expense_filter import (
+    FilterProfile,
+    DEFAULT_PROFILE,
+    load_filter_profiles,
+    streamed_expense_thresholds,
+    expense_filter,
+)
+from members import Member, get_members, load_members_cache, save_members_cache
+from tools import get_year_codes_range, cache_dir
+
+
+EXPORT_FIELDS = [
+    "claim_number",
+    "year_code",
+    "date",
+    "member_id",
+    "member_name",
+    "party",
+    "category",
+    "expense_type",
+    "short_desc",
+    "amount_claimed",
+    "amount_paid",
+    "status",
+    "tweet_text",
+]
+MEMBERS_CACHE_FILE = "members_cache.json"
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--from-year", type=int, required=True, help="First financial year, e.g. 2015 for 15_16")
+    parser.add_argument("--to-year", type=int, required=True, help="Year after the last financial year")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    parser.add_argument("--out", default="-", help="Output file, - for stdout")
+    parser.add_argument("--workers", type=int, default=8, help="Worker threads for member lookups")
+    parser.add_argument("--profile", default=None, help="Filter profile name from filter_profiles.json")
+    parser.add_argument("--force", action="store_true", help="Re-download years even if cached")
+    return parser
+
+
+def export_row(expense: Expense, year_code: str, member: Optional[Member]) -> Dict[str, Any]:
+    return {
+        "claim_number": expense.claim_number,
+        "year_code": year_code,
+        "date": expense.date.isoformat(),
+        "member_id": expense.member_id,
+        "member_name": member.name if member else None,
+        "party": member.party_abbr if member else None,
+        "category": expense.category,
+        "expense_type": expense.expense_type,
+        "short_desc": expense.short_desc,
+        "amount_claimed": str(expense.amount_claimed),
+        "amount_paid": str(expense.amount_paid),
+        "status": expense.status,
+        "tweet_text": expense.claim_text(fetch_member=member is not None),
+    }
+
+
+def render_rows(expenses: List[Expense], year_code: str, workers: int) -> Iterator[Dict[str, Any]]:
+    members = get_members([e.member_id for e in expenses if "DUMMY" not in e.claim_number], workers)
+    for expense in expenses:
+        yield export_row(expense, year_code, members.get(expense.member_id))
+
+
+def export_filtered(
+    year_codes: List[str],
+    out: TextIO,
+    output_format: str = "csv",
+    profile: FilterProfile = DEFAULT_PROFILE,
+    workers: int = 8,
+    force: bool = False,
+) -> int:
+    """Stream the filtered expenses for the years given to out, returning how
+    many rows were written."""
+    load_year = lambda year_code: get_expenses(year_code, force)
+    thresholds = streamed_expense_thresholds(
+        year_codes, load_year, profile.top_percentile, profile.minimum_count
+    )
+
+    writer = None
+    if output_format == "csv":
+        writer = csv.DictWriter(out, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+
+    written = 0
+    for year_code in year_codes:
+        expenses = [
+            e for e in load_year(year_code)
+            if profile.in_scope(e) and expense_filter(e, *thresholds, profile.is_vip)
+            and profile.member_in_scope(e)
+        ]
+        for row in render_rows(expenses, year_code, workers):
+            if writer is not None:
+                writer.writerow(row)
+            else:
+                out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            written += 1
+        out.flush()
+        print(f"Exported {len(expenses)} expenses for year code '{year_code}'.", file=sys.stderr)
+    return written
+
+
+def main(argv: List[str]) -> None:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    year_codes = get_year_codes_range(args.from_year, args.to_year)
+    profile = DEFAULT_PROFILE
+    if args.profile is not None:
+        profiles = {p.name: p for p in load_filter_profiles()}
+        if args.profile not in profiles:
+            parser.error(f"unknown profile '{args.profile}', expected one of {sorted(profiles)}")
+        profile = profiles[args.profile]
+
+    out = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8", newline="")
+    # Everything else logs with print, which would end up among the rows
+    with redirect_stdout(sys.stderr):
+        members_cache_path = os.path.join(cache_dir(), MEMBERS_CACHE_FILE)
+        load_members_cache(members_cache_path)
+        try:
+            written = export_filtered(year_codes, out, args.format, profile, args.workers, args.force)
+        finally:
+            if args.out != "-":
+                out.close()
+            os.makedirs(cache_dir(), exist_ok=True)
+            save_members_cache(members_cache_path)
+    print(f"Exported {written} rows for {year_codes}.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
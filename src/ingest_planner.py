@@ -0,0 +1,287 @@
+import os
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from expenses import Expense
+from expense_importer import get_expenses, get_expenses_csv, parse_expenses, cached_csv_path
+from expense_filter import Thresholds, expense_thresholds, expenses_filter, streamed_expense_thresholds
+from expense_delta import manifest_path
+from anomaly_scores import expenses_frame, cached_anomaly_scores, cached_frame_anomaly_scores
+from csv_cache import write_cache_file, read_cache_file, read_cache_info
+from tools import load_json, save_json, cache_dir, get_year_codes_range
+
+
+MEMORY_MODE = "memory"
+CHUNKED_MODE = "chunked"
+SPILL_MODE = "spill"
+INGEST_MODES = [MEMORY_MODE, CHUNKED_MODE, SPILL_MODE]
+
+# Rough sizes measured with tracemalloc, erring high
+EXPENSE_BYTES = 2500  # a parsed Expense and its row dict
+PARSE_BYTES = 2000  # transient DataFrame and record dicts while a year is parsed
+FRAME_BYTES = 200  # a row of expenses_frame
+CSV_ROW_BYTES = 250  # for estimating rows from a cached CSV's size
+DEFAULT_YEAR_ROWS = 100000
+MEMORY_BUDGET_FRACTION = 0.7
+ROW_COUNTS_FILE = "ingest_row_counts.json"
+
+
+def available_memory_bytes() -> Optional[int]:
+    """The memory this process may use: the Lambda memory setting, else the
+    cgroup limit, else physical memory."""
+    lambda_mb = os.getenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE")
+    if lambda_mb:
+        return int(lambda_mb) * 1024 * 1024
+
+    for path in ["/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"]:
+        try:
+            with open(path, "r") as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # Unlimited is "max" in cgroup v2 and a huge number in v1
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """The highest RSS over the life of the process so far, not just recently."""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def row_counts_path() -> str:
+    return os.path.join(cache_dir(), ROW_COUNTS_FILE)
+
+
+def load_row_counts() -> Dict[str, int]:
+    try:
+        return load_json(row_counts_path())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_row_counts(row_counts: Dict[str, int]) -> None:
+    os.makedirs(cache_dir(), exist_ok=True)
+    save_json({**load_row_counts(), **row_counts}, row_counts_path(), indent=None)
+
+
+def estimate_year_rows(year_code: str, row_counts: Optional[Dict[str, int]] = None) -> int:
+    """Expected rows for a year from the last ingest, the delta manifest or the
+    cached CSV's size, whichever is found first."""
+    row_counts = load_row_counts() if row_counts is None else row_counts
+    if year_code in row_counts:
+        return int(row_counts[year_code])
+
+    try:
+        return int(load_json(manifest_path(year_code))["row_count"])
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+
+    header = read_cache_info(cached_csv_path(year_code))
+    if header.get("length"):
+        return int(header["length"]) // CSV_ROW_BYTES
+    return DEFAULT_YEAR_ROWS
+
+
+class IngestPlan:
+
+    def __init__(
+        self,
+        mode: str,
+        year_codes: List[str],
+        year_rows: Dict[str, int],
+        budget_bytes: Optional[int],
+    ):
+        self.mode = mode
+        self.year_codes = year_codes
+        self.year_rows = year_rows
+        self.budget_bytes = budget_bytes
+
+    def __repr__(self):
+        budget = f"{self.budget_bytes // (1024 * 1024)}MB" if self.budget_bytes else "unknown"
+        return (
+            f"<IngestPlan {self.mode}: {len(self.year_codes)} years, "
+            f"~{self.estimated_rows} rows, ~{self.estimated_bytes(self.mode) // (1024 * 1024)}MB "
+            f"of {budget}>"
+        )
+
+    @property
+    def estimated_rows(self) -> int:
+        return sum(self.year_rows.values())
+
+    @property
+    def largest_year_rows(self) -> int:
+        return max(self.year_rows.values(), default=0)
+
+    def estimated_bytes(self, mode: str) -> int:
+        total = self.estimated_rows
+        largest = self.largest_year_rows
+        if mode == MEMORY_MODE:
+            # Every year is parsed at once
+            return total * (EXPENSE_BYTES + PARSE_BYTES)
+        one_year = largest * (EXPENSE_BYTES + PARSE_BYTES) + total * FRAME_BYTES
+        if mode == CHUNKED_MODE:
+            # One year parsed at a time, with every year's CSV text held between passes
+            return one_year + total * CSV_ROW_BYTES
+        return one_year
+
+
+def plan_ingest(
+    year_codes: List[str], budget_bytes: Optional[int] = None, mode: Optional[str] = None
+) -> IngestPlan:
+    """Choose the cheapest way of loading and filtering the years given that is
+    expected to fit in the memory budget. MPE_INGEST_MODE forces a mode."""
+    if budget_bytes is None:
+        available = available_memory_bytes()
+        budget_bytes = int(available * MEMORY_BUDGET_FRACTION) if available else None
+
+    row_counts = load_row_counts()
+    plan = IngestPlan(
+        MEMORY_MODE,
+        year_codes,
+        {year_code: estimate_year_rows(year_code, row_counts) for year_code in year_codes},
+        budget_bytes,
+    )
+
+    mode = mode or os.getenv("MPE_INGEST_MODE")
+    if mode is not None:
+        if mode not in INGEST_MODES:
+            raise ValueError(f"Unknown ingest mode '{mode}', expected one of {INGEST_MODES}")
+        plan.mode = mode
+    elif budget_bytes is None:
+        plan.mode = CHUNKED_MODE
+    else:
+        plan.mode = next(
+            (m for m in [MEMORY_MODE, CHUNKED_MODE] if plan.estimated_bytes(m) <= budget_bytes),
+            SPILL_MODE,
+        )
+    print(f"Planned ingest {plan}")
+    return plan
+
+
+class IngestResult:
+    """The outcome of running a plan. In chunked and spill mode the full expenses
+    are not kept, only the filtered ones and an expenses_frame of all of them."""
+
+    def __init__(
+        self,
+        plan: IngestPlan,
+        thresholds: Thresholds,
+        filtered: List[Expense],
+        row_count: int,
+        expenses: Optional[List[Expense]] = None,
+        frame: Optional[pd.DataFrame] = None,
+    ):
+        self.plan = plan
+        self.thresholds = thresholds
+        self.filtered = filtered
+        self.row_count = row_count
+        self.expenses = expenses
+        self.frame = frame
+
+    def anomaly_scores(self) -> pd.DataFrame:
+        if self.expenses is not None:
+            return cached_anomaly_scores(self.expenses)
+        return cached_frame_anomaly_scores(self.frame)
+
+
+def load_years(year_codes: List[str], force: bool, parallel: bool) -> Dict[str, List[Expense]]:
+    if parallel:
+        with ThreadPoolExecutor() as executor:
+            results = executor.map(lambda year: get_expenses(year, force), year_codes)
+            return dict(zip(year_codes, results))
+    return {year_code: get_expenses(year_code, force) for year_code in year_codes}
+
+
+def spill_path(year_code: str) -> str:
+    return os.path.join(cache_dir(), f"{year_code}.spill")
+
+
+def run_by_year(plan: IngestPlan, force: bool) -> IngestResult:
+    """Two passes over the years, one at a time. The first computes thresholds
+    and the expenses_frame and the second parses each year again to filter it,
+    so only one year's expenses are held at once. Between the passes each
+    year's CSV text is kept in memory in chunked mode and on disk in spill mode."""
+    frames = []
+    row_counts = {}
+    held_csv = {}
+
+    def first_pass(year_code: str) -> List[Expense]:
+        csv_text = get_expenses_csv(year_code, force)
+        if plan.mode == SPILL_MODE:
+            write_cache_file(spill_path(year_code), csv_text)
+        else:
+            held_csv[year_code] = csv_text
+        expenses = parse_expenses(year_code, csv_text)
+        frames.append(expenses_frame(expenses))
+        row_counts[year_code] = len(expenses)
+        return expenses
+
+    thresholds = streamed_expense_thresholds(plan.year_codes, first_pass)
+
+    filtered = []
+    for year_code in plan.year_codes:
+        if plan.mode == SPILL_MODE:
+            csv_text, _ = read_cache_file(spill_path(year_code))
+            os.remove(spill_path(year_code))
+        else:
+            csv_text = held_csv.pop(year_code)
+        filtered += expenses_filter(parse_expenses(year_code, csv_text), thresholds)
+        del csv_text
+
+    save_row_counts(row_counts)
+    frame = pd.concat(frames, ignore_index=True) if frames else expenses_frame([])
+    return IngestResult(plan, thresholds, filtered, sum(row_counts.values()), frame=frame)
+
+
+def run_plan(plan: IngestPlan, force: bool = False) -> IngestResult:
+    """Load and filter the plan's years, logging how long it took and how much
+    the process's peak RSS grew while doing it."""
+    start = time.perf_counter()
+    peak_before = peak_rss_bytes()
+    if plan.mode in [CHUNKED_MODE, SPILL_MODE]:
+        result = run_by_year(plan, force)
+    else:
+        by_year = load_years(plan.year_codes, force, parallel=True)
+        save_row_counts({year_code: len(expenses) for year_code, expenses in by_year.items()})
+        expenses = [expense for sublist in by_year.values() for expense in sublist]
+        del by_year
+        thresholds = expense_thresholds(expenses)
+        result = IngestResult(
+            plan, thresholds, expenses_filter(expenses, thresholds), len(expenses), expenses=expenses
+        )
+
+    peak = peak_rss_bytes()
+    if peak is None:
+        peak_str = "unknown"
+    else:
+        # A peak reached before this ingest hides anything lower during it
+        peak_str = f"{peak // (1024 * 1024)}MB (+{(peak - peak_before) // (1024 * 1024)}MB during this ingest)"
+    print(
+        f"Ingested {result.row_count} expenses ({len(result.filtered)} after filters) in {plan.mode} "
+        f"mode in {round(time.perf_counter() - start, 2)} seconds, process peak RSS {peak_str}."
+    )
+    return result
+
+
+def ingest_since_year(from_year: int, budget_bytes: Optional[int] = None) -> IngestResult:
+    """Planned equivalent of expenses_filter(get_expenses_since_year(from_year))."""
+    year_codes = get_year_codes_range(from_year, datetime.utcnow().year)
+    return run_plan(plan_ingest(year_codes, budget_bytes), force=True)
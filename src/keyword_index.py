@@ -0,0 +1,140 @@
+import re
+import sqlite3
+from typing import List, Set, Tuple, Optional
+
+from expenses import Expense, keyed_expenses
+from expense_index import connect, expenses_for_keys, year_fingerprint, DateRange
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS keyword_postings (
+    term TEXT NOT NULL,
+    row_key TEXT NOT NULL,
+    field TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    year_code TEXT NOT NULL,
+    PRIMARY KEY (term, row_key, field, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_keyword_postings_year ON keyword_postings (year_code);
+
+CREATE TABLE IF NOT EXISTS keyword_years (
+    year_code TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL
+);
+"""
+
+INDEXED_FIELDS = {
+    "short_desc": lambda e: e.short_desc,
+    "details": lambda e: e.details,
+}
+TOKEN_PATTERN = re.compile(r"[A-Z0-9]+")
+QUERY_PATTERN = re.compile(r'"([^"]+)"|(\S+)')
+
+Posting = Tuple[str, str, int]
+
+
+def tokenise(text: Optional[str]) -> List[str]:
+    if text is None:
+        return []
+    return TOKEN_PATTERN.findall(str(text).upper())
+
+
+def keyword_connect() -> sqlite3.Connection:
+    conn = connect()
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def keyword_fingerprint(conn: sqlite3.Connection, year_code: str) -> Optional[str]:
+    row = conn.execute(
+        "SELECT fingerprint FROM keyword_years WHERE year_code = ?", (year_code,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def index_keywords(year_code: str, expenses: List[Expense]) -> bool:
+    """Replace the keyword postings for a year, returning False without
+    touching them if they were built from the year's currently indexed
+    content. The expenses should be the ones just given to index_expenses."""
+    conn = keyword_connect()
+    try:
+        fingerprint = year_fingerprint(conn, year_code)
+        if fingerprint is not None and keyword_fingerprint(conn, year_code) == fingerprint:
+            return False
+
+        rows = [
+            (term, key, field, position, year_code)
+            for key, expense in keyed_expenses(expenses).items()
+            for field, get_text in INDEXED_FIELDS.items()
+            for position, term in enumerate(tokenise(get_text(expense)))
+        ]
+        with conn:
+            conn.execute("DELETE FROM keyword_postings WHERE year_code = ?", (year_code,))
+            conn.executemany("INSERT OR IGNORE INTO keyword_postings VALUES (?, ?, ?, ?, ?)", rows)
+            if fingerprint is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO keyword_years VALUES (?, ?)", (year_code, fingerprint)
+                )
+        print(f"Indexed {len(rows)} keyword postings for year code '{year_code}'.")
+        return True
+    finally:
+        conn.close()
+
+
+def term_postings(conn: sqlite3.Connection, term: str, prefix: bool = False) -> Set[Posting]:
+    term = term.upper()
+    if not prefix:
+        rows = conn.execute(
+            "SELECT row_key, field, position FROM keyword_postings WHERE term = ?", (term,)
+        )
+    else:
+        upper = term[:-1] + chr(ord(term[-1]) + 1)
+        rows = conn.execute(
+            "SELECT row_key, field, position FROM keyword_postings WHERE term >= ? AND term < ?",
+            (term, upper),
+        )
+    return set(rows)
+
+
+def phrase_postings(conn: sqlite3.Connection, phrase: str) -> Set[Posting]:
+    """Postings of the first term of each occurrence of the phrase."""
+    terms = tokenise(phrase)
+    if not terms:
+        return set()
+    matches = term_postings(conn, terms[0])
+    for offset, term in enumerate(terms[1:], start=1):
+        if not matches:
+            break
+        following = term_postings(conn, term)
+        matches = {(k, f, p) for k, f, p in matches if (k, f, p + offset) in following}
+    return matches
+
+
+def search_keys(query: str) -> Set[str]:
+    """Row keys matching every part of the query. Parts are plain terms,
+    prefixes ending in '*' or double-quoted phrases."""
+    conn = keyword_connect()
+    try:
+        keys = None
+        for phrase, word in QUERY_PATTERN.findall(query):
+            if phrase:
+                postings = phrase_postings(conn, phrase)
+            elif word.endswith("*"):
+                prefix = "".join(tokenise(word[:-1]))
+                postings = term_postings(conn, prefix, prefix=True) if prefix else set()
+            else:
+                postings = phrase_postings(conn, word)
+            matched = {key for key, _, _ in postings}
+            keys = matched if keys is None else keys & matched
+            if not keys:
+                return set()
+        return keys or set()
+    finally:
+        conn.close()
+
+
+def search_expenses(query: str, date_range: Optional[DateRange] = None) -> List[Expense]:
+    keys = search_keys(query)
+    print(f"Found {len(keys)} expenses matching '{query}'.")
+    return expenses_for_keys(keys, date_range)
+
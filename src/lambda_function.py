@@ -1,12 +1,15 @@
-from datetime import datetime, time, timedelta
+import asyncio
+from datetime import datetime, time, timedelta, date
 import random
+from typing import List, Optional, Tuple
 from zoneinfo import ZoneInfo
 
-from expenses import exp_list_str
-from expense_importer import get_expenses_since_year
-from expense_filter import expenses_filter
+from expenses import Expense, exp_list_str
+from ingest_planner import ingest_since_year
 from twitter_tools import TwitterClient
-from aws_tools import save_item_to_db, item_in_db
+from aws_tools import claim_item_in_db, delete_item_from_db
+from tweet_queue import build_tweet_queue, pop_tweet_entry
+from tweet_poster import PendingPost, publish_posts, load_retry_posts, update_retry_posts
 from tools import pp
 
 
@@ -14,62 +17,147 @@ TWEET_START_TIME = time(6, 55, 0)
 TWEET_END_TIME = time(21, 5, 0)
 
 
-def lambda_handler(event, context):
-    force = event.get("force") is True
+def london_now() -> datetime:
+    return datetime.now(ZoneInfo("Europe/London"))
 
-    # Ensure it is within tweeting time
-    now = datetime.now(ZoneInfo("Europe/London"))
-    if not force and not (TWEET_START_TIME <= now.time() <= TWEET_END_TIME):
-        message = f"{now.time()} Not within tweeting time of {TWEET_START_TIME}-{TWEET_END_TIME}"
-        print(message)
-        return {"statusCode": 200, "tweet_id": None, "message": message}
 
-    # Get all expenses from last few spreadsheet years
-    expenses = get_expenses_since_year(now.year - 2)
-    print(f"Found {exp_list_str(expenses)}")
+def within_tweeting_time(now: datetime) -> bool:
+    return TWEET_START_TIME <= now.time() <= TWEET_END_TIME
+
+
+def tweet_window(now: datetime) -> Tuple[date, date]:
+    return (now - timedelta(weeks=52)).date(), (now - timedelta(weeks=8)).date()
+
+
+def within_tweet_window(expenses: List[Expense], now: datetime) -> List[Expense]:
+    min_date, max_date = tweet_window(now)
+    return [e for e in expenses if max_date >= e.date >= min_date]
+
 
-    # Filter
-    min_date = (now - timedelta(weeks=52)).date()
-    max_date = (now - timedelta(weeks=8)).date()
-    expenses = [e for e in expenses_filter(expenses) if max_date >= e.date >= min_date]
+def get_tweet_candidates(now: datetime) -> List[Expense]:
+    # Get and filter all expenses from last few spreadsheet years
+    result = ingest_since_year(now.year - 2)
+    print(f"Found {result.row_count} expenses")
+
+    expenses = within_tweet_window(result.filtered, now)
     print(f"Found {exp_list_str(expenses)} after filters.")
+    return expenses
 
-    # Choose randomly from remaining
-    while True:
-        expense = random.choice(expenses)
-        print(f"Checking if expense {expense.claim_number} has already been used.")
-        if not item_in_db(expense.claim_number):
-            break
 
-    # Tweet the expense
-    print(f"Chosen expense {expense}")
-    tweet_text = expense.claim_text()
-    print(f"Tweeting: {tweet_text}")
+def claim_expense(expense: Expense) -> bool:
+    """Claim the expense in the tweets table, False if it's already used or
+    claimed by a post waiting to be retried."""
+    return claim_item_in_db(
+        {"expense_id": expense.claim_number, "when_created": datetime.utcnow().isoformat()}
+    )
+
+
+def claim_text_or_fallback(expense: Expense) -> str:
+    """The tweet text, with the member id in place of the name if the member
+    can't be looked up."""
+    try:
+        return expense.claim_text()
+    except Exception as e:
+        print(f"Error getting member for {expense.claim_number} - {e}")
+        return expense.claim_text(fetch_member=False)
+
+
+def release_claims(posts: List[PendingPost]) -> None:
+    for post in posts:
+        print(f"Releasing claim on {post.expense_id}.")
+        delete_item_from_db(post.expense_id)
+
+
+def choose_posts(expenses: List[Expense], count: int) -> List[PendingPost]:
+    # Choose randomly from remaining, rendering before claiming so a failure
+    # can't leave a claim behind
+    chosen = []
+    try:
+        for expense in random.sample(expenses, len(expenses)):
+            tweet_text = claim_text_or_fallback(expense)
+            print(f"Claiming expense {expense.claim_number} if not already used.")
+            if claim_expense(expense):
+                print(f"Chosen expense {expense}")
+                chosen.append(PendingPost(expense.claim_number, tweet_text))
+            if len(chosen) >= count:
+                break
+    except Exception:
+        release_claims(chosen)
+        raise
+    return chosen
+
+
+def pick_posts(now: datetime, count: int) -> List[PendingPost]:
+    """Claim and render up to count new posts. If anything fails before they're
+    returned, the claims made so far are released."""
+    posts = []
+    if count <= 0:
+        return posts
+
     try:
-        twitter = TwitterClient()
-        tweet = twitter.tweet(tweet_text)
+        # Use the precomputed queue if the batch stage has built one
+        min_date, max_date = tweet_window(now)
+        while len(posts) < count:
+            entry = pop_tweet_entry(min_date, max_date)
+            if entry is None:
+                break
+            posts.append(PendingPost(entry["expense_id"], entry["tweet_text"]))
+
+        if len(posts) < count:
+            posts += choose_posts(get_tweet_candidates(now), count - len(posts))
+    except Exception:
+        release_claims(posts)
+        raise
+    return posts
+
+
+def publish(posts: List[PendingPost], thread: bool = False, twitter: Optional[TwitterClient] = None) -> dict:
+    for post in posts:
+        print(f"Tweeting: {post.tweet_text}")
+    try:
+        return asyncio.run(publish_posts(posts, thread, twitter))
     except Exception as e:
-        msg = "Error while tweeting: {e}"
+        msg = f"Error while tweeting: {e}"
         print(msg)
-        e.with_traceback()
+        # Only the posts that didn't go out, so nothing is tweeted twice
+        update_retry_posts(posts, [p for p in posts if p.tweet_id is None])
         return {"statusCode": 500, "error": msg}
 
-    # Save to DB
-    item = {
-        "expense_id": expense.claim_number,
-        "tweet_id": tweet["id"] if tweet else None,
-        "when_created": datetime.utcnow().isoformat(),
-    }
-    if tweet is None:
-        print("Tweet came back NULL.")
-    else:
-        save_item_to_db(item)
-        print("tweet saved to db!")
-
-    return {
-        "statusCode": 200,
-        "data": item,
-    }
+
+def tweet_expense(expense: Expense, twitter: Optional[TwitterClient] = None) -> dict:
+    """Tweet an expense already claimed with claim_expense."""
+    print(f"Chosen expense {expense}")
+    return publish([PendingPost(expense.claim_number, claim_text_or_fallback(expense))], twitter=twitter)
+
+
+def lambda_handler(event, context):
+    force = event.get("force") is True
+    count = int(event.get("count", 1))
+    thread = event.get("thread") is True
+
+    # Ensure it is within tweeting time
+    now = london_now()
+    if not force and not within_tweeting_time(now):
+        message = f"{now.time()} Not within tweeting time of {TWEET_START_TIME}-{TWEET_END_TIME}"
+        print(message)
+        return {"statusCode": 200, "tweet_id": None, "message": message}
+
+    # Previously failed posts go first. They stay on the retry queue until
+    # publish has dealt with them.
+    posts = load_retry_posts()[:count]
+    if posts:
+        print(f"Retrying {len(posts)} previously failed posts.")
+
+    posts += pick_posts(now, count - len(posts))
+    return publish(posts, thread)
+
+
+def queue_handler(event, context):
+    now = london_now()
+    result = ingest_since_year(now.year - 2)
+    candidates = within_tweet_window(result.filtered, now)
+    sampler = build_tweet_queue(candidates, result.thresholds, now.date(), result.anomaly_scores())
+    return {"statusCode": 200, "queued": len(sampler)}
 
 
 if __name__ == "__main__":
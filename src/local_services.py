@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, Optional, List
+
+import requests
+from botocore.exceptions import ClientError
+
+
+FAKE_TWITTER_KEYS = {
+    "BEARER_TOKEN": "local",
+    "API_KEY": "local",
+    "API_KEY_SECRET": "local",
+    "ACCESS_TOKEN": "local",
+    "ACCESS_TOKEN_SECRET": "local",
+}
+UPSTREAMS = {
+    "ipsa": "https://www.theipsa.org.uk",
+    "members": "https://members-api.parliament.uk",
+}
+
+
+def local_services_enabled() -> bool:
+    return os.environ.get("MPE_LOCAL_SERVICES") is not None
+
+
+class FakeSecretsManager:
+
+    def __init__(self, secrets: Optional[Dict[str, Any]] = None):
+        self.secrets = secrets or {}
+        self.calls = Counter()
+
+    def get_secret_value(self, SecretId: str) -> Dict[str, str]:
+        self.calls["get_secret_value"] += 1
+        return {"SecretString": json.dumps(self.secrets.get(SecretId, FAKE_TWITTER_KEYS))}
+
+
+class FakeDynamoTable:
+    """In-memory stand-in for the subset of the DynamoDB Table API that's used."""
+
+    def __init__(self, key_name: str = "expense_id", page_size: int = 1000):
+        self.key_name = key_name
+        self.page_size = page_size
+        self.items: Dict[str, Dict[str, Any]] = {}
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def put_item(self, Item: Dict[str, Any], ConditionExpression: Optional[str] = None) -> dict:
+        self.calls["put_item"] += 1
+        key = Item[self.key_name]
+        with self._lock:
+            if ConditionExpression == f"attribute_not_exists({self.key_name})" and key in self.items:
+                raise ClientError(
+                    {"Error": {"Code": "ConditionalCheckFailedException", "Message": "exists"}},
+                    "PutItem",
+                )
+            self.items[key] = dict(Item)
+        return {}
+
+    def get_item(self, Key: Dict[str, Any]) -> dict:
+        self.calls["get_item"] += 1
+        item = self.items.get(Key[self.key_name])
+        return {} if item is None else {"Item": dict(item)}
+
+    def delete_item(self, Key: Dict[str, Any]) -> dict:
+        self.calls["delete_item"] += 1
+        with self._lock:
+            self.items.pop(Key[self.key_name], None)
+        return {}
+
+    def scan(self, ProjectionExpression: Optional[str] = None, ExclusiveStartKey=None) -> dict:
+        self.calls["scan"] += 1
+        keys = sorted(self.items)
+        start = 0
+        if ExclusiveStartKey is not None:
+            start = keys.index(ExclusiveStartKey[self.key_name]) + 1
+        page = keys[start:start + self.page_size]
+        fields = ProjectionExpression.split(",") if ProjectionExpression else None
+        response = {
+            "Items": [
+                {f.strip(): self.items[k][f.strip()] for f in fields} if fields else dict(self.items[k])
+                for k in page
+            ]
+        }
+        if start + self.page_size < len(keys):
+            response["LastEvaluatedKey"] = {self.key_name: page[-1]}
+        return response
+
+
+class FakeTweetResponse:
+
+    def __init__(self, data: Dict[str, Any], headers: Dict[str, str], status_code: int = 201):
+        self._data = data
+        self.headers = headers
+        self.status_code = status_code
+
+    def json(self) -> Dict[str, Any]:
+        return {"data": self._data}
+
+
+def error_response(status_code: int, reason: str, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response.reason = reason
+    response.headers.update(headers or {})
+    response._content = json.dumps({"title": reason, "detail": reason}).encode("utf-8")
+    return response
+
+
+class FakeTweetSink:
+    """Stands in for tweepy.Client, recording tweets and reporting a rate limit
+    in the same headers the Twitter API sends. Once the limit is used up it
+    raises TooManyRequests until the window resets, like the real API."""
+
+    def __init__(self, limit: int = 10000, window_seconds: int = 15 * 60):
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.tweets: List[Dict[str, Any]] = []
+        self.calls = Counter()
+        self.failing: Dict[str, Exception] = {}
+        self._window_start = time.time()
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def fail_on(self, text: str, error: Exception) -> None:
+        """Raise error instead of posting whenever text is tweeted."""
+        self.failing[text] = error
+
+    def rate_limit_headers(self) -> Dict[str, str]:
+        return {
+            "x-rate-limit-limit": str(self.limit),
+            "x-rate-limit-remaining": str(max(0, self.limit - self._used)),
+            "x-rate-limit-reset": str(int(self._window_start + self.window_seconds)),
+        }
+
+    def create_tweet(self, text: str, in_reply_to_tweet_id: Optional[str] = None) -> FakeTweetResponse:
+        import tweepy
+
+        self.calls["create_tweet"] += 1
+        with self._lock:
+            if text in self.failing:
+                raise self.failing[text]
+            now = time.time()
+            if now - self._window_start >= self.window_seconds:
+                self._window_start = now
+                self._used = 0
+            if self._used >= self.limit:
+                raise tweepy.TooManyRequests(
+                    error_response(429, "Too Many Requests", self.rate_limit_headers())
+                )
+            self._used += 1
+            tweet = {"id": str(len(self.tweets) + 1), "text": text, "in_reply_to": in_reply_to_tweet_id}
+            self.tweets.append(tweet)
+            headers = self.rate_limit_headers()
+        return FakeTweetResponse({"id": tweet["id"], "text": text}, headers)
+
+
+class FixtureServer:
+    """Local HTTP server replaying recorded responses for the IPSA and Members
+    APIs. Requests go to /<upstream>/<path>, e.g. /ipsa/api/download?... and in
+    record mode any response not yet recorded is fetched from the real service
+    and saved. Responses carry an ETag and honour If-None-Match."""
+
+    def __init__(self, fixtures_dir: str, record: bool = False, port: int = 0):
+        self.fixtures_dir = fixtures_dir
+        self.record = record
+        self.requests = Counter()
+        os.makedirs(fixtures_dir, exist_ok=True)
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def upstream_url(self, name: str) -> str:
+        return f"{self.url}/{name}"
+
+    def start(self) -> "FixtureServer":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def fixture_path(self, path: str) -> str:
+        name = hashlib.sha1(path.encode("utf-8")).hexdigest()
+        return os.path.join(self.fixtures_dir, f"{name}.json")
+
+    def load_fixture(self, path: str) -> Optional[Dict[str, Any]]:
+        fixture_path = self.fixture_path(path)
+        if os.path.exists(fixture_path):
+            with open(fixture_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        if not self.record:
+            return None
+
+        upstream, _, rest = path.lstrip("/").partition("/")
+        if upstream not in UPSTREAMS:
+            return None
+        print(f"Recording fixture for {path}")
+        resp = requests.get(f"{UPSTREAMS[upstream]}/{rest}")
+        resp.encoding = "utf-8"
+        fixture = {
+            "path": path,
+            "status": resp.status_code,
+            "content_type": resp.headers.get("Content-Type", "text/plain"),
+            "body": resp.text,
+        }
+        with open(fixture_path, "w", encoding="utf-8") as f:
+            json.dump(fixture, f, ensure_ascii=False)
+        return fixture
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                fixture = server.load_fixture(self.path)
+                if fixture is None:
+                    server.requests[(self.path.split("/")[1], 404)] += 1
+                    self.send_error(404, f"No fixture recorded for {self.path}")
+                    return
+
+                body = fixture["body"].encode("utf-8")
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    server.requests[(self.path.split("/")[1], 304)] += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+
+                server.requests[(self.path.split("/")[1], fixture["status"])] += 1
+                self.send_response(fixture["status"])
+                self.send_header("Content-Type", fixture["content_type"])
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+SECRETS_MANAGER = FakeSecretsManager()
+DDB_TABLE = FakeDynamoTable()
+TWEET_SINK = FakeTweetSink()
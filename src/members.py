@@ -2,6 +2,7 @@ import requests
 import json
 import time
 from typing import List, Union, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
 
 from tools import *
 
@@ -10,6 +11,7 @@ members_cache = {}
 
 _MEMBERS_OF_NOTE_IDS = None
 VIP_MEMBERS_FILE = "vip_members.json"
+MEMBERS_API_URL = os.getenv("MPE_MEMBERS_API_URL", "https://members-api.parliament.uk")
 
 
 class Member:
@@ -68,7 +70,7 @@ def get_api_json(url, params=None) -> Dict[str, Any]:
 
 
 def get_member_data(member_id) -> dict:
-    url = "https://members-api.parliament.uk/api/Members/{}".format(member_id)
+    url = "{}/api/Members/{}".format(MEMBERS_API_URL, member_id)
     print("Requesting member data for id {}.".format(member_id))
     return get_api_json(url)["value"]
 
@@ -87,9 +89,42 @@ def get_member(member_id: int) -> Member:
     return member
 
 
+def get_member_or_none(member_id: int) -> Optional[Member]:
+    try:
+        return get_member(member_id)
+    except Exception as e:
+        print(f"Error getting member {member_id} - {e}")
+        return None
+
+
+def get_members(member_ids: List[int], workers: int = 8) -> Dict[int, Optional[Member]]:
+    """Look up many members at once, only hitting the API for uncached ones."""
+    missing = sorted({int(i) for i in member_ids if int(i) not in members_cache})
+    if missing:
+        print(f"Requesting data for {len(missing)} uncached members.")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(get_member_or_none, missing))
+    return {int(i): members_cache.get(int(i)) for i in member_ids}
+
+
+def load_members_cache(file_path: str) -> None:
+    try:
+        data = load_json(file_path)
+    except FileNotFoundError:
+        return
+    for member_data in data.values():
+        member = Member(member_data)
+        members_cache.setdefault(member.id, member)
+    print(f"Loaded {len(data)} members from {file_path}.")
+
+
+def save_members_cache(file_path: str) -> None:
+    save_json({str(i): m.data for i, m in members_cache.items()}, file_path, indent=None)
+
+
 def search_member(name: str) -> Optional[Member]:
     print(f"Searching for member with name '{name}'.")
-    url = "https://members-api.parliament.uk/api/Members/Search"
+    url = f"{MEMBERS_API_URL}/api/Members/Search"
     api_return = get_api_json(url, {"Name": name})
     members = [Member(item["value"]) for item in api_return["items"]]
 
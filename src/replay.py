@@ -0,0 +1,154 @@
+"""Replay months of hourly lambda_handler invocations against local stand-ins
+for every external service, reporting latency, calls made per invocation and
+cache hit rates.
+
+    python replay.py --fixtures ../fixtures --record --days 90
+
+Run once with --record (needs network) to capture IPSA and Members API
+responses, after which replays are fully offline.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta
+from statistics import median, quantiles
+from typing import List, Dict, Any
+from zoneinfo import ZoneInfo
+
+from local_services import FixtureServer
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", default="../fixtures", help="Recorded HTTP responses directory")
+    parser.add_argument("--record", action="store_true", help="Record missing responses from the live services")
+    parser.add_argument("--days", type=int, default=90, help="Days of hourly invocations to simulate")
+    parser.add_argument("--start", default=None, help="Simulated start date, YYYY-MM-DD (default today)")
+    parser.add_argument("--queue", action="store_true", help="Run the queue batch stage once a simulated day")
+    parser.add_argument("--cache-dir", default=None, help="Cache directory (default a fresh temp dir)")
+    return parser.parse_args(argv)
+
+
+def percentile_summary(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    if len(values) == 1:
+        return {"p50": values[0], "p95": values[0], "max": values[0]}
+    return {
+        "p50": round(median(values), 4),
+        "p95": round(quantiles(values, n=20, method="inclusive")[-1], 4),
+        "max": round(max(values), 4),
+    }
+
+
+def counter_delta(after: Counter, before: Counter) -> Counter:
+    return Counter({k: after[k] - before[k] for k in after if after[k] - before[k]})
+
+
+def replay(args: argparse.Namespace) -> Dict[str, Any]:
+    server = FixtureServer(args.fixtures, record=args.record).start()
+
+    # Must be set before the handler modules are imported
+    os.environ["MPE_LOCAL_SERVICES"] = "1"
+    os.environ["MPE_IPSA_URL"] = server.upstream_url("ipsa")
+    os.environ["MPE_MEMBERS_API_URL"] = server.upstream_url("members")
+    os.environ["MPE_CACHE_DIR"] = args.cache_dir or tempfile.mkdtemp(prefix="mpe_replay_")
+    os.environ.pop("MPE_QUEUE_BUCKET", None)
+
+    import local_services
+    import lambda_function
+    import expense_importer
+    import members
+
+    # Count cache hits and Members API lookups
+    stats = Counter()
+    get_cache_csv = expense_importer.get_cache_csv
+    get_member_data = members.get_member_data
+
+    def counted_get_cache_csv(year_code):
+        csv_text = get_cache_csv(year_code)
+        stats["csv_cache_hit" if csv_text is not None else "csv_cache_miss"] += 1
+        return csv_text
+
+    def counted_get_member_data(member_id):
+        stats["member_api_lookup"] += 1
+        return get_member_data(member_id)
+
+    expense_importer.get_cache_csv = counted_get_cache_csv
+    members.get_member_data = counted_get_member_data
+
+    start = datetime.fromisoformat(args.start) if args.start else datetime.now()
+    start = start.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=ZoneInfo("Europe/London"))
+
+    invocations = []
+    for hour in range(args.days * 24):
+        now = start + timedelta(hours=hour)
+        lambda_function.london_now = lambda: now
+
+        before = {
+            "http": Counter(server.requests),
+            "ddb": Counter(local_services.DDB_TABLE.calls),
+            "twitter": Counter(local_services.TWEET_SINK.calls),
+            "stats": Counter(stats),
+        }
+        began = time.perf_counter()
+        if args.queue and now.hour == 0:
+            lambda_function.queue_handler({}, None)
+        result = lambda_function.lambda_handler({}, None)
+        elapsed = time.perf_counter() - began
+
+        invocations.append(
+            {
+                "now": now,
+                "seconds": elapsed,
+                "tweeted": len(result.get("data") or []),
+                "http": counter_delta(server.requests, before["http"]),
+                "ddb": counter_delta(local_services.DDB_TABLE.calls, before["ddb"]),
+                "twitter": counter_delta(local_services.TWEET_SINK.calls, before["twitter"]),
+                "stats": counter_delta(stats, before["stats"]),
+            }
+        )
+
+    server.stop()
+    return summarise(invocations, stats)
+
+
+def summarise(invocations: List[Dict[str, Any]], stats: Counter) -> Dict[str, Any]:
+    active = [i for i in invocations if i["tweeted"] or i["http"] or i["ddb"]]
+    tenth = max(1, len(active) // 10)
+
+    def mean_calls(group: List[Dict[str, Any]], kind: str) -> float:
+        return round(sum(sum(i[kind].values()) for i in group) / max(1, len(group)), 2)
+
+    def phase(group: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {
+            "latency_seconds": percentile_summary([i["seconds"] for i in group]),
+            "http_calls": mean_calls(group, "http"),
+            "ddb_calls": mean_calls(group, "ddb"),
+            "twitter_calls": mean_calls(group, "twitter"),
+        }
+
+    hits = stats["csv_cache_hit"]
+    misses = stats["csv_cache_miss"]
+    http = Counter()
+    for i in invocations:
+        http.update(i["http"])
+    return {
+        "invocations": len(invocations),
+        "active_invocations": len(active),
+        "tweets": sum(i["tweeted"] for i in invocations),
+        "overall": phase(active),
+        "first_tenth": phase(active[:tenth]),
+        "last_tenth": phase(active[-tenth:]),
+        "csv_cache_hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+        "http_by_status": {f"{route} {status}": n for (route, status), n in sorted(http.items())},
+        "member_api_lookups": stats["member_api_lookup"],
+    }
+
+
+if __name__ == "__main__":
+    from tools import pp
+    pp(replay(parse_args(sys.argv[1:])))
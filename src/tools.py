@@ -3,9 +3,25 @@ import os
 import json
 import random
 from datetime import datetime, date
+from pathlib import Path
 from typing import Dict, Any, List, Optional
 
 
+CACHE_DIR = "../csv_cache"
+
+
+def in_aws() -> bool:
+    return os.environ.get("AWS_EXECUTION_ENV") is not None
+
+
+def cache_dir() -> str:
+    if os.environ.get("MPE_CACHE_DIR"):
+        return os.environ["MPE_CACHE_DIR"]
+    if in_aws():
+        return "/tmp/csv_cache"
+    return os.path.join(Path(__file__).parent.absolute(), CACHE_DIR)
+
+
 def pp(d: dict) -> None:
     print(json.dumps(d, indent=2, default=str, ensure_ascii=False))
 
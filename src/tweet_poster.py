@@ -0,0 +1,213 @@
+import asyncio
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+
+import tweepy
+
+from twitter_tools import TwitterClient, RateLimit
+from aws_tools import save_item_to_db, delete_item_from_db, load_stored_json, save_stored_json
+
+
+RETRY_KEY = "retry_posts.json"
+MAX_CONCURRENT_POSTS = 3
+MAX_QUOTA_WAIT_SECONDS = 60
+MAX_ATTEMPTS = 3
+MAX_TOTAL_ATTEMPTS = 10
+RETRY_BACKOFF_SECONDS = 2
+
+
+class PendingPost:
+
+    def __init__(
+        self,
+        expense_id: str,
+        tweet_text: str,
+        attempts: int = 0,
+        last_error: Optional[str] = None,
+    ):
+        self.expense_id = str(expense_id)
+        self.tweet_text = tweet_text
+        self.attempts = attempts
+        self.last_error = last_error
+        self.tweet_id: Optional[str] = None
+
+    def __repr__(self):
+        return f"<PendingPost {self.expense_id} attempts={self.attempts}>"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "expense_id": self.expense_id,
+            "tweet_text": self.tweet_text,
+            "attempts": self.attempts,
+            "last_error": self.last_error,
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "PendingPost":
+        return cls(d["expense_id"], d["tweet_text"], d.get("attempts", 0), d.get("last_error"))
+
+
+def load_retry_posts() -> List[PendingPost]:
+    stored = load_stored_json(RETRY_KEY) or {"posts": []}
+    return [PendingPost.from_dict(d) for d in stored["posts"]]
+
+
+def save_retry_posts(posts: List[PendingPost]) -> None:
+    save_stored_json({"posts": [p.to_dict() for p in posts]}, RETRY_KEY)
+    print(f"Saved {len(posts)} posts to the retry queue.")
+
+
+def update_retry_posts(handled: List[PendingPost], retry: List[PendingPost]) -> None:
+    """Replace any queued entries for the handled posts with the ones still to
+    retry. Retried posts stay queued until this runs, so a crash while posting
+    doesn't lose them."""
+    handled_ids = {p.expense_id for p in handled}
+    stored = load_retry_posts()
+    kept = [p for p in stored if p.expense_id not in handled_ids]
+    if len(kept) == len(stored) and not retry:
+        return
+    save_retry_posts(kept + retry)
+
+
+class TweetPoster:
+    """Posts tweets off the event loop, pacing them against the rate limit
+    reported by the Twitter API instead of running into 429s."""
+
+    def __init__(self, twitter: Optional[TwitterClient] = None):
+        self.twitter = twitter or TwitterClient()
+        self.rate_limit: Optional[RateLimit] = None
+        self._semaphore = asyncio.Semaphore(MAX_CONCURRENT_POSTS)
+
+    @property
+    def quota(self) -> Optional[int]:
+        if self.rate_limit is None or self.rate_limit.remaining is None:
+            return None
+        if self.rate_limit.seconds_until_reset <= 0:
+            return None
+        return self.rate_limit.remaining
+
+    async def wait_for_quota(self) -> bool:
+        if self.rate_limit is None or not self.rate_limit.exhausted:
+            return True
+        wait = self.rate_limit.seconds_until_reset
+        if wait > MAX_QUOTA_WAIT_SECONDS:
+            print(f"Rate limit exhausted for another {wait:.0f} seconds, not waiting.")
+            return False
+        print(f"Rate limit exhausted, waiting {wait:.0f} seconds.")
+        await asyncio.sleep(wait)
+        return True
+
+    async def post(self, post: PendingPost, in_reply_to: Optional[str] = None) -> Optional[dict]:
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            if not await self.wait_for_quota():
+                post.last_error = "Rate limit exhausted"
+                return None
+
+            post.attempts += 1
+            try:
+                async with self._semaphore:
+                    data, self.rate_limit = await asyncio.to_thread(
+                        self.twitter.post, post.tweet_text, in_reply_to
+                    )
+                post.tweet_id = data["id"]
+                print(f"Posted {post.expense_id} as tweet {data['id']}. {self.rate_limit}")
+                return data
+            except tweepy.TooManyRequests as e:
+                self.rate_limit = RateLimit.from_headers(e.response.headers)
+                post.last_error = str(e)
+                print(f"Rate limited posting {post.expense_id}. {self.rate_limit}")
+            except tweepy.TweepyException as e:
+                post.last_error = str(e)
+                print(f"Error posting {post.expense_id} - {e}")
+                await asyncio.sleep(RETRY_BACKOFF_SECONDS * attempt)
+        return None
+
+    async def post_batch(
+        self, posts: List[PendingPost]
+    ) -> Tuple[List[Tuple[PendingPost, dict]], List[PendingPost]]:
+        """Post independent tweets concurrently, within the remaining quota.
+        Returns the posted (post, tweet) pairs and the posts that weren't sent."""
+        posted = []
+        failed = []
+        pending = list(posts)
+
+        # First post alone to learn the quota from its response headers
+        if pending and self.quota is None:
+            post = pending.pop(0)
+            tweet = await self.post(post)
+            if tweet:
+                posted.append((post, tweet))
+            else:
+                failed.append(post)
+
+        quota = self.quota
+        if quota is not None and len(pending) > quota:
+            print(f"Only {quota} posts left in the rate limit, deferring {len(pending) - quota}.")
+            failed += pending[quota:]
+            pending = pending[:quota]
+
+        tweets = await asyncio.gather(*(self.post(post) for post in pending))
+        for post, tweet in zip(pending, tweets):
+            if tweet:
+                posted.append((post, tweet))
+            else:
+                failed.append(post)
+        return posted, failed
+
+    async def post_thread(
+        self, posts: List[PendingPost]
+    ) -> Tuple[List[Tuple[PendingPost, dict]], List[PendingPost]]:
+        """Post tweets as a thread, each replying to the last. Stops at the
+        first failure and returns the rest unsent."""
+        posted = []
+        in_reply_to = None
+        for i, post in enumerate(posts):
+            tweet = await self.post(post, in_reply_to)
+            if tweet is None:
+                return posted, posts[i:]
+            posted.append((post, tweet))
+            in_reply_to = tweet["id"]
+        return posted, []
+
+
+async def publish_posts(
+    posts: List[PendingPost], thread: bool = False, twitter: Optional[TwitterClient] = None
+) -> Dict[str, Any]:
+    """Post the given claims, record the successful ones in the db and put the
+    failures on the retry queue so that no pick is lost. The posts are expected
+    to be claimed in the db already, which keeps them from being picked again
+    while they wait to be retried."""
+    poster = TweetPoster(twitter)
+    if thread:
+        posted, failed = await poster.post_thread(posts)
+    else:
+        posted, failed = await poster.post_batch(posts)
+
+    items = []
+    for post, tweet in posted:
+        item = {
+            "expense_id": post.expense_id,
+            "tweet_id": tweet["id"],
+            "when_created": datetime.utcnow().isoformat(),
+        }
+        try:
+            save_item_to_db(item)
+        except Exception as e:
+            # The tweet is out and its claim still stops it being picked again
+            print(f"Error saving tweet {tweet['id']} for {post.expense_id} - {e}")
+        items.append(item)
+
+    retry_posts = [p for p in failed if p.attempts < MAX_TOTAL_ATTEMPTS]
+    dropped = [p for p in failed if p.attempts >= MAX_TOTAL_ATTEMPTS]
+    if dropped:
+        print(f"Dropping {dropped} after {MAX_TOTAL_ATTEMPTS} attempts, releasing their claims.")
+        for post in dropped:
+            delete_item_from_db(post.expense_id)
+    update_retry_posts(posts, retry_posts)
+
+    return {
+        "statusCode": 200,
+        "data": items,
+        "failed": [p.to_dict() for p in failed],
+        "rate_limit": None if poster.rate_limit is None else vars(poster.rate_limit),
+    }
@@ -0,0 +1,103 @@
+from datetime import datetime, date
+from typing import List, Dict, Any, Optional
+
+import pandas as pd
+
+from expenses import Expense, exp_list_str
+from expense_filter import Thresholds
+from candidate_sampler import CandidateSampler, score_expenses
+from members import Member, get_members
+from aws_tools import (
+    get_all_item_ids,
+    claim_item_in_db,
+    load_stored_json,
+    save_stored_json,
+)
+
+
+QUEUE_KEY = "tweet_queue.json"
+
+
+def load_queue() -> Optional[CandidateSampler]:
+    queue = load_stored_json(QUEUE_KEY)
+    return None if queue is None else CandidateSampler.from_dict(queue)
+
+
+def save_queue(sampler: CandidateSampler) -> None:
+    save_stored_json({"created": datetime.utcnow().isoformat(), **sampler.to_dict()}, QUEUE_KEY)
+    print(f"Saved tweet queue of {len(sampler)} entries.")
+
+
+def resolve_members(expenses: List[Expense]) -> Dict[int, Optional[Member]]:
+    """Look up every member once up front so rendering hits the members cache.
+    Members whose lookup fails map to None."""
+    return get_members([e.member_id for e in expenses if "DUMMY" not in e.claim_number])
+
+
+def queue_entry(expense: Expense, member: Optional[Member]) -> Dict[str, Any]:
+    return {
+        "expense_id": str(expense.claim_number),
+        "date": expense.date.isoformat(),
+        "tweet_text": expense.claim_text(fetch_member=member is not None),
+    }
+
+
+def build_tweet_queue(
+    candidates: List[Expense],
+    thresholds: Thresholds,
+    today: date,
+    anomalies: Optional[pd.DataFrame] = None,
+) -> CandidateSampler:
+    """Batch stage: the untweeted candidates, de-duplicated, pre-rendered and
+    weighted by interest for sampling."""
+    used = get_all_item_ids()
+    fresh = {}
+    for expense in candidates:
+        claim_number = str(expense.claim_number)
+        if claim_number not in used and claim_number not in fresh:
+            fresh[claim_number] = expense
+    expenses = list(fresh.values())
+    print(f"Building tweet queue from {exp_list_str(expenses)} not yet tweeted.")
+
+    members = resolve_members(expenses)
+    weights = score_expenses(expenses, thresholds, today, anomalies)
+    entries = [queue_entry(e, members.get(e.member_id)) for e in expenses]
+    sampler = CandidateSampler(entries, weights.tolist())
+    save_queue(sampler)
+    return sampler
+
+
+def pop_tweet_entry(min_date: date, max_date: date) -> Optional[Dict[str, Any]]:
+    """Claim a weighted random queued entry within the date window. The claim
+    is a conditional write to the tweets table so concurrent pops can't share
+    an entry, even though the queue file itself is rewritten without locking."""
+    sampler = load_queue()
+    if sampler is None or len(sampler) == 0:
+        return None
+
+    chosen = None
+    stale = set()
+    not_yet = set()
+    while chosen is None:
+        i = sampler.draw(skip=stale | not_yet)
+        if i is None:
+            break
+        entry = sampler.entries[i]
+        entry_date = date.fromisoformat(entry["date"])
+        if entry_date < min_date:
+            stale.add(i)
+        elif entry_date > max_date:
+            not_yet.add(i)
+        elif claim_item_in_db(
+            {"expense_id": entry["expense_id"], "when_created": datetime.utcnow().isoformat()}
+        ):
+            chosen = i
+        else:
+            stale.add(i)
+
+    entry = None if chosen is None else sampler.entries[chosen]
+    sampler.mark_used(*stale, *([] if chosen is None else [chosen]))
+    save_queue(sampler)
+    if entry is not None:
+        print(f"Popped queued expense {entry['expense_id']}, {len(sampler)} left.")
+    return entry
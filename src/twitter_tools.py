@@ -1,3 +1,7 @@
+import time
+from typing import Optional, Tuple
+
+import requests
 import tweepy
 
 from aws_tools import *
@@ -6,22 +10,65 @@ from aws_tools import *
 TWITTER_KEYS = get_secret_dict(os.getenv("MPE_TWITTER_SECRET_NAME"))
 
 
+class RateLimit:
+
+    def __init__(self, limit: Optional[int], remaining: Optional[int], reset: Optional[int]):
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+
+    def __repr__(self):
+        return f"<RateLimit {self.remaining}/{self.limit} reset={self.reset}>"
+
+    @classmethod
+    def from_headers(cls, headers) -> "RateLimit":
+        def header_int(name: str) -> Optional[int]:
+            value = headers.get(name)
+            return int(value) if value is not None else None
+
+        return cls(
+            header_int("x-rate-limit-limit"),
+            header_int("x-rate-limit-remaining"),
+            header_int("x-rate-limit-reset"),
+        )
+
+    @property
+    def seconds_until_reset(self) -> float:
+        if self.reset is None:
+            return 0
+        return max(0.0, self.reset - time.time())
+
+    @property
+    def exhausted(self) -> bool:
+        return self.remaining is not None and self.remaining <= 0 and self.seconds_until_reset > 0
+
+
 class TwitterClient:
 
     def __init__(self):
+        if local_services_enabled():
+            self.client = local_services.TWEET_SINK
+            return
         self.client = tweepy.Client(
             bearer_token=TWITTER_KEYS["BEARER_TOKEN"],
             consumer_key=TWITTER_KEYS["API_KEY"],
             consumer_secret=TWITTER_KEYS["API_KEY_SECRET"],
             access_token=TWITTER_KEYS["ACCESS_TOKEN"],
             access_token_secret=TWITTER_KEYS["ACCESS_TOKEN_SECRET"],
+            return_type=requests.Response,
         )
 
+    def post(self, text: str, in_reply_to: Optional[str] = None) -> Tuple[dict, RateLimit]:
+        """Post a tweet, returning its data and the rate limit state from the
+        response headers. Raises tweepy exceptions on failure."""
+        response = self.client.create_tweet(text=text, in_reply_to_tweet_id=in_reply_to)
+        return response.json()["data"], RateLimit.from_headers(response.headers)
+
     def tweet(self, text: str) -> dict:
         try:
-            tweet_response = self.client.create_tweet(text=text)
+            data, rate_limit = self.post(text)
         except tweepy.TweepyException as e:
             print("Error during tweeting:", e)
             return None
-        print("Tweet posted successfully!")
-        return tweet_response.data
+        print(f"Tweet posted successfully! {rate_limit}")
+        return data
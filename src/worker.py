@@ -0,0 +1,126 @@
+import hashlib
+import random
+import threading
+from datetime import datetime
+from typing import List, Dict, Optional
+
+from expenses import Expense, exp_list_str
+from expense_importer import get_expenses_csv, parse_expenses
+from expense_filter import expenses_filter
+from lambda_function import (
+    london_now,
+    within_tweeting_time,
+    within_tweet_window,
+    claim_expense,
+    tweet_expense,
+    publish,
+)
+from tweet_poster import load_retry_posts
+from twitter_tools import TwitterClient
+from tools import get_year_codes_range, pp
+
+
+REFRESH_INTERVAL_SECONDS = 6 * 60 * 60
+TWEET_INTERVAL_SECONDS = 60 * 60
+
+
+class ExpenseWorker:
+    """Long running alternative to the lambda handler which keeps the filtered
+    expenses in memory and only rebuilds them when the source data changes."""
+
+    def __init__(
+        self,
+        refresh_interval: int = REFRESH_INTERVAL_SECONDS,
+        tweet_interval: int = TWEET_INTERVAL_SECONDS,
+    ):
+        self.refresh_interval = refresh_interval
+        self.tweet_interval = tweet_interval
+        self.candidates: List[Expense] = []
+        self.csv_hashes: Dict[str, str] = {}
+        self.last_refresh: Optional[datetime] = None
+        self.twitter = TwitterClient()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresh_thread = None
+
+    def refresh(self) -> bool:
+        """Re-download the source CSVs and rebuild the candidates if any changed."""
+        now = london_now()
+        year_codes = get_year_codes_range(now.year - 2, now.year)
+        csv_texts = {year_code: get_expenses_csv(year_code, force=True) for year_code in year_codes}
+        csv_hashes = {
+            year_code: hashlib.sha1(text.encode("utf-8")).hexdigest()
+            for year_code, text in csv_texts.items()
+        }
+        self.last_refresh = datetime.utcnow()
+        if csv_hashes == self.csv_hashes:
+            print("Source data unchanged, keeping current candidates.")
+            return False
+
+        expenses = []
+        for year_code, text in csv_texts.items():
+            expenses += parse_expenses(year_code, text)
+        candidates = expenses_filter(expenses)
+        print(f"Refreshed worker with {exp_list_str(candidates)} after filters.")
+
+        with self._lock:
+            self.candidates = candidates
+            self.csv_hashes = csv_hashes
+        return True
+
+    def _refresh_loop(self) -> None:
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing worker data - {e}")
+
+    def pick(self, now: datetime) -> Optional[Expense]:
+        with self._lock:
+            candidates = within_tweet_window(self.candidates, now)
+        while candidates:
+            expense = candidates.pop(random.randrange(len(candidates)))
+            if claim_expense(expense):
+                return expense
+            self._discard(expense)
+        return None
+
+    def _discard(self, expense: Expense) -> None:
+        with self._lock:
+            self.candidates = [e for e in self.candidates if e is not expense]
+
+    def tick(self) -> Optional[dict]:
+        now = london_now()
+        if not within_tweeting_time(now):
+            return None
+        retry_posts = load_retry_posts()
+        if retry_posts:
+            return publish(retry_posts[:1], twitter=self.twitter)
+
+        expense = self.pick(now)
+        if expense is None:
+            print("No untweeted candidates left.")
+            return None
+        result = tweet_expense(expense, self.twitter)
+        self._discard(expense)
+        return result
+
+    def start(self) -> None:
+        self.refresh()
+        self._refresh_thread = threading.Thread(target=self._refresh_loop, daemon=True)
+        self._refresh_thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run_forever(self) -> None:
+        self.start()
+        while not self._stop.is_set():
+            result = self.tick()
+            if result is not None:
+                pp(result)
+            self._stop.wait(self.tweet_interval)
+
+
+if __name__ == "__main__":
+    ExpenseWorker().run_forever()
@@ -108,6 +108,10 @@ resource "aws_dynamodb_table" "past_tweets_table" {
   hash_key = "expense_id"
 }
 
+resource "aws_s3_bucket" "tweet_queue_bucket" {
+  bucket = "${var.PROJECT_NAME}-tweet-queue"
+}
+
 resource "aws_iam_policy" "lambda_policy" {
   name        = "${var.PROJECT_NAME}-lambda-policy"
   description = "Policy for ${var.PROJECT_NAME} lambda"
@@ -123,10 +127,25 @@ resource "aws_iam_policy" "lambda_policy" {
       {
         Action = [
           "dynamodb:GetItem",
-          "dynamodb:PutItem"
+          "dynamodb:PutItem",
+          "dynamodb:DeleteItem",
+          "dynamodb:Scan"
         ],
         Effect   = "Allow",
         Resource = aws_dynamodb_table.past_tweets_table.arn
+      },
+      {
+        Action = [
+          "s3:GetObject",
+          "s3:PutObject"
+        ],
+        Effect   = "Allow",
+        Resource = "${aws_s3_bucket.tweet_queue_bucket.arn}/*"
+      },
+      {
+        Action   = "s3:ListBucket",
+        Effect   = "Allow",
+        Resource = aws_s3_bucket.tweet_queue_bucket.arn
       }
     ]
   })
@@ -158,6 +177,28 @@ resource "aws_lambda_function" "lambda_function" {
     variables = {
       MPE_TWITTER_SECRET_NAME = data.aws_secretsmanager_secret.twitter_secret.name
       MPE_DDB_TABLE_NAME = aws_dynamodb_table.past_tweets_table.name
+      MPE_QUEUE_BUCKET = aws_s3_bucket.tweet_queue_bucket.bucket
+    }
+  }
+
+  depends_on = [null_resource.build_lambda]
+}
+
+resource "aws_lambda_function" "queue_lambda_function" {
+  function_name = "${var.PROJECT_NAME}-queue-lambda-function"
+  filename      = data.archive_file.lambda_package.output_path
+  role          = aws_iam_role.lambda_iam_role.arn
+  runtime       = "python3.10"
+  handler       = "lambda_function.queue_handler"
+  timeout       = 300
+  memory_size   = 1028
+  source_code_hash = data.archive_file.lambda_package.output_base64sha256
+
+  environment {
+    variables = {
+      MPE_TWITTER_SECRET_NAME = data.aws_secretsmanager_secret.twitter_secret.name
+      MPE_DDB_TABLE_NAME = aws_dynamodb_table.past_tweets_table.name
+      MPE_QUEUE_BUCKET = aws_s3_bucket.tweet_queue_bucket.bucket
     }
   }
 
@@ -185,3 +226,23 @@ resource "aws_lambda_permission" "allow_eventbridge" {
   source_arn    = aws_cloudwatch_event_rule.trigger_every_hour.arn
 }
 
+
+resource "aws_cloudwatch_event_rule" "trigger_every_day" {
+  name        = "${var.PROJECT_NAME}-queue-lambda-trigger"
+  description = "Rebuilds the tweet queue every day"
+  schedule_expression = "rate(1 day)"
+}
+
+resource "aws_cloudwatch_event_target" "queue_lambda_target" {
+  rule      = aws_cloudwatch_event_rule.trigger_every_day.name
+  target_id = "${var.PROJECT_NAME}-queue-lambda-target"
+  arn       = aws_lambda_function.queue_lambda_function.arn
+}
+
+resource "aws_lambda_permission" "allow_eventbridge_queue" {
+  statement_id  = "AllowEventBridgeInvoke"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.queue_lambda_function.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.trigger_every_day.arn
+}
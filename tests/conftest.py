@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Run against the local stand-ins rather than AWS and Twitter
+os.environ["MPE_LOCAL_SERVICES"] = "1"
+os.environ.pop("MPE_QUEUE_BUCKET", None)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
@@ -0,0 +1,168 @@
+import asyncio
+
+import pytest
+import tweepy
+
+import local_services
+import tweet_poster
+from local_services import FakeTweetSink, error_response
+from twitter_tools import TwitterClient
+from tweet_poster import PendingPost, publish_posts, load_retry_posts, save_retry_posts
+
+
+@pytest.fixture(autouse=True)
+def local_state(tmp_path, monkeypatch):
+    monkeypatch.setenv("MPE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(tweet_poster, "RETRY_BACKOFF_SECONDS", 0)
+    local_services.DDB_TABLE.items.clear()
+
+
+def fake_twitter(limit: int) -> TwitterClient:
+    twitter = TwitterClient()
+    twitter.client = FakeTweetSink(limit=limit)
+    return twitter
+
+
+def claimed_posts(count: int):
+    posts = [PendingPost(f"claim-{i}", f"Tweet {i}") for i in range(count)]
+    for post in posts:
+        local_services.DDB_TABLE.put_item(Item={"expense_id": post.expense_id})
+    return posts
+
+
+def test_rate_limited_post_is_kept_for_retry():
+    twitter = fake_twitter(limit=0)
+    posts = claimed_posts(1)
+
+    result = asyncio.run(publish_posts(posts, twitter=twitter))
+
+    assert result["data"] == []
+    assert [p["expense_id"] for p in result["failed"]] == ["claim-0"]
+    assert result["rate_limit"]["remaining"] == 0
+    # Gives up rather than waiting out the window or retrying into more 429s
+    assert twitter.client.calls["create_tweet"] == 1
+    assert [p.expense_id for p in load_retry_posts()] == ["claim-0"]
+    assert "claim-0" in local_services.DDB_TABLE.items
+
+
+def test_batch_beyond_quota_defers_the_rest():
+    twitter = fake_twitter(limit=3)
+    posts = claimed_posts(5)
+
+    result = asyncio.run(publish_posts(posts, twitter=twitter))
+
+    assert len(result["data"]) == 3
+    assert len(result["failed"]) == 2
+    # The quota from the first response stops it sending into a 429
+    assert twitter.client.calls["create_tweet"] == 3
+    posted = {item["expense_id"] for item in result["data"]}
+    deferred = {p.expense_id for p in load_retry_posts()}
+    assert posted | deferred == {p.expense_id for p in posts}
+    assert not posted & deferred
+    for item in result["data"]:
+        assert local_services.DDB_TABLE.items[item["expense_id"]]["tweet_id"] == item["tweet_id"]
+
+
+def test_thread_replies_to_previous_tweet():
+    twitter = fake_twitter(limit=10)
+    posts = claimed_posts(3)
+
+    result = asyncio.run(publish_posts(posts, thread=True, twitter=twitter))
+
+    tweets = twitter.client.tweets
+    assert [t["text"] for t in tweets] == ["Tweet 0", "Tweet 1", "Tweet 2"]
+    assert [t["in_reply_to"] for t in tweets] == [None, tweets[0]["id"], tweets[1]["id"]]
+    assert len(result["data"]) == 3
+    assert load_retry_posts() == []
+
+
+def test_thread_stops_at_failure():
+    twitter = fake_twitter(limit=10)
+    posts = claimed_posts(3)
+    twitter.client.fail_on("Tweet 1", tweepy.TwitterServerError(error_response(503, "Service Unavailable")))
+
+    result = asyncio.run(publish_posts(posts, thread=True, twitter=twitter))
+
+    assert [item["expense_id"] for item in result["data"]] == ["claim-0"]
+    assert [t["text"] for t in twitter.client.tweets] == ["Tweet 0"]
+    assert twitter.client.calls["create_tweet"] == 1 + tweet_poster.MAX_ATTEMPTS
+    # The failed post and the rest of the thread wait to be retried
+    assert [p.expense_id for p in load_retry_posts()] == ["claim-1", "claim-2"]
+    assert posts[1].attempts == tweet_poster.MAX_ATTEMPTS
+    assert posts[2].attempts == 0
+
+
+def test_posts_out_of_attempts_release_their_claims():
+    twitter = fake_twitter(limit=0)
+    posts = claimed_posts(1)
+    posts[0].attempts = tweet_poster.MAX_TOTAL_ATTEMPTS - 1
+
+    asyncio.run(publish_posts(posts, twitter=twitter))
+
+    assert load_retry_posts() == []
+    assert "claim-0" not in local_services.DDB_TABLE.items
+
+
+def test_publish_error_only_requeues_unposted(monkeypatch):
+    import lambda_function
+
+    twitter = fake_twitter(limit=1)
+    posts = claimed_posts(2)
+    update_retry_posts = tweet_poster.update_retry_posts
+
+    def unavailable(handled, retry):
+        monkeypatch.setattr(tweet_poster, "update_retry_posts", update_retry_posts)
+        raise RuntimeError("Storage unavailable")
+
+    monkeypatch.setattr(tweet_poster, "update_retry_posts", unavailable)
+
+    result = lambda_function.publish(posts, twitter=twitter)
+
+    assert result["statusCode"] == 500
+    assert [t["text"] for t in twitter.client.tweets] == ["Tweet 0"]
+    assert [p.expense_id for p in load_retry_posts()] == ["claim-1"]
+
+
+def test_retried_posts_leave_the_queue_only_once_published():
+    twitter = fake_twitter(limit=10)
+    queued = claimed_posts(3)
+    save_retry_posts(queued)
+
+    # As the handler does, retried posts are taken without trimming the queue
+    retried = load_retry_posts()[:2]
+    assert len(load_retry_posts()) == 3
+
+    asyncio.run(publish_posts(retried, twitter=twitter))
+
+    assert [p.expense_id for p in load_retry_posts()] == ["claim-2"]
+
+
+def test_failed_render_or_pick_leaves_no_claim(monkeypatch):
+    import lambda_function
+
+    class Unrenderable:
+        claim_number = "claim-x"
+
+        def claim_text(self, fetch_member=True):
+            if fetch_member:
+                raise TypeError("'NoneType' object is not subscriptable")
+            return "Claim claim-x"
+
+    posts = lambda_function.choose_posts([Unrenderable()], 1)
+    assert [(p.expense_id, p.tweet_text) for p in posts] == [("claim-x", "Claim claim-x")]
+
+    # A failure after claiming, before the posts are handed to publish
+    local_services.DDB_TABLE.items.clear()
+    monkeypatch.setattr(lambda_function, "pop_tweet_entry", lambda *args: None)
+    monkeypatch.setattr(lambda_function, "get_tweet_candidates", lambda now: [Unrenderable(), Unrenderable()])
+    claim_expense = lambda_function.claim_expense
+
+    def claim_then_fail(expense):
+        if local_services.DDB_TABLE.items:
+            raise RuntimeError("Throttled")
+        return claim_expense(expense)
+
+    monkeypatch.setattr(lambda_function, "claim_expense", claim_then_fail)
+    with pytest.raises(RuntimeError):
+        lambda_function.pick_posts(lambda_function.london_now(), 2)
+    assert local_services.DDB_TABLE.items == {}